@@ -1,184 +1,2117 @@
+import argparse
+import csv
+import glob
+import itertools
+import json
+import math
+import os
+import queue
+import threading
+import time
+import zlib
 import cv2
 import numpy as np
-import mediapipe as mp
-from collections import deque
-
-bpoints = [deque(maxlen=1024)]
-gpoints = [deque(maxlen=1024)]
-rpoints = [deque(maxlen=1024)]
-ypoints = [deque(maxlen=1024)]
-
-blue_index = 0
-green_index = 0
-red_index = 0
-yellow_index = 0
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from network import CanvasLink, parse_address, start_relay
+from session import (EV_POINT, EV_PEN_UP, EV_CLEAR, EV_COLOR, EV_FILL, EV_SHAPE, EV_STAMP,
+                     EV_COMMIT, EV_UNDO, EV_REDO, EV_RESET, SessionRecorder, read_session)
+from svg_export import export_svg
 
 kernel = np.ones((5, 5), np.uint8)
 
 colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (0, 255, 255)]
-colorIndex = 0
-shapeIndex = 0  # 0 for Freehand, 1 for Circle, 2 for Rectangle, 3 for Triangle
 
 # Split screen layout, webcam on the right and canvas on the left
 canvas_width, canvas_height = 640, 480  # Canvas on the left side
 webcam_width, webcam_height = 640, 480  # Set webcam to initial size (640x480)
-paintWindow = np.ones((canvas_height, canvas_width, 3)) * 255  # Canvas size on the left side
-paintWindow = cv2.rectangle(paintWindow, (40, 1), (140, 65), (0, 0, 0), 2)
-paintWindow = cv2.rectangle(paintWindow, (160, 1), (255, 65), (255, 0, 0), 2)
-paintWindow = cv2.rectangle(paintWindow, (275, 1), (370, 65), (0, 255, 0), 2)
-paintWindow = cv2.rectangle(paintWindow, (390, 1), (485, 65), (0, 0, 255), 2)
-paintWindow = cv2.rectangle(paintWindow, (505, 1), (600, 65), (0, 255, 255), 2)
-paintWindow = cv2.rectangle(paintWindow, (605, 1), (700, 65), (255, 255, 255), 2)
-paintWindow = cv2.rectangle(paintWindow, (710, 1), (800, 65), (0, 0, 0), 2)  # Rectangle for shapes
-
-cv2.putText(paintWindow, "CLEAR", (49, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-cv2.putText(paintWindow, "BLUE", (185, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-cv2.putText(paintWindow, "GREEN", (298, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-cv2.putText(paintWindow, "RED", (420, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-cv2.putText(paintWindow, "YELLOW", (520, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-cv2.putText(paintWindow, "FILL", (615, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-cv2.putText(paintWindow, "SHAPE", (725, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-
-cv2.namedWindow('Paint', cv2.WINDOW_AUTOSIZE)
-
-mpHands = mp.solutions.hands
-hands = mpHands.Hands(max_num_hands=1, min_detection_confidence=0.7)
-mpDraw = mp.solutions.drawing_utils
-
-cap = cv2.VideoCapture(0)
-cap.set(3, webcam_width)  # Set webcam width to default size (640)
-cap.set(4, webcam_height)  # Set webcam height to default size (480)
-ret = True
-fill_mode = False
-
-while ret:
-    ret, frame = cap.read()
-
-    # Flip the frame and convert to RGB
-    frame = cv2.flip(frame, 1)
-    framergb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-    # Resize the webcam frame to match the height of the canvas
-    frame_resized = cv2.resize(frame, (canvas_width, canvas_height))
 
-    # Draw the UI elements
-    frame_resized = cv2.rectangle(frame_resized, (40, 1), (140, 65), (0, 0, 0), 2)
-    frame_resized = cv2.rectangle(frame_resized, (160, 1), (255, 65), (255, 0, 0), 2)
-    frame_resized = cv2.rectangle(frame_resized, (275, 1), (370, 65), (0, 255, 0), 2)
-    frame_resized = cv2.rectangle(frame_resized, (390, 1), (485, 65), (0, 0, 255), 2)
-    frame_resized = cv2.rectangle(frame_resized, (505, 1), (600, 65), (0, 255, 255), 2)
-    frame_resized = cv2.rectangle(frame_resized, (605, 1), (700, 65), (255, 255, 255), 2)
-    frame_resized = cv2.rectangle(frame_resized, (710, 1), (800, 65), (0, 0, 0), 2)
-
-    cv2.putText(frame_resized, "CLEAR", (49, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-    cv2.putText(frame_resized, "BLUE", (185, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-    cv2.putText(frame_resized, "GREEN", (298, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-    cv2.putText(frame_resized, "RED", (420, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-    cv2.putText(frame_resized, "YELLOW", (520, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-    cv2.putText(frame_resized, "FILL", (615, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-    cv2.putText(frame_resized, "SHAPE", (725, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2, cv2.LINE_AA)
-
-    result = hands.process(framergb)
-
-    if result.multi_hand_landmarks:
-        landmarks = []
-        for handslms in result.multi_hand_landmarks:
-            for lm in handslms.landmark:
-                lmx = int(lm.x * webcam_width)
-                lmy = int(lm.y * webcam_height)
-
-                landmarks.append([lmx, lmy])
-
-            mpDraw.draw_landmarks(frame_resized, handslms, mpHands.HAND_CONNECTIONS)
-
-        fore_finger = (landmarks[8][0], landmarks[8][1])
-        center = fore_finger
-        thumb = (landmarks[4][0], landmarks[4][1])
-
-        if (thumb[1] - center[1] < 30):
-            bpoints.append(deque(maxlen=512))
-            blue_index += 1
-            gpoints.append(deque(maxlen=512))
-            green_index += 1
-            rpoints.append(deque(maxlen=512))
-            red_index += 1
-            ypoints.append(deque(maxlen=512))
-            yellow_index += 1
-
-        elif center[1] <= 65:
-            if 40 <= center[0] <= 140:
-                bpoints = [deque(maxlen=512)]
-                gpoints = [deque(maxlen=512)]
-                rpoints = [deque(maxlen=512)]
-                ypoints = [deque(maxlen=512)]
-
-                blue_index = 0
-                green_index = 0
-                red_index = 0
-                yellow_index = 0
-
-                paintWindow[67:,:,:] = 255
-            elif 160 <= center[0] <= 255:
-                colorIndex = 0  # Blue
-            elif 275 <= center[0] <= 370:
-                colorIndex = 1  # Green
-            elif 390 <= center[0] <= 485:
-                colorIndex = 2  # Red
-            elif 505 <= center[0] <= 600:
-                colorIndex = 3  # Yellow
-            elif 605 <= center[0] <= 700:
-                fill_mode = not fill_mode  # Toggle fill mode
-            elif 710 <= center[0] <= 800:
-                shapeIndex = (shapeIndex + 1) % 4  # Cycle through shapes
+# MediaPipe is imported on first use, so replays and synthetic runs work
+# without it
+mpHands = None
+mpDraw = None
+
+
+def load_mediapipe():
+    global mpHands, mpDraw
+    if mpHands is None:
+        import mediapipe as mp
+        mpHands = mp.solutions.hands
+        mpDraw = mp.solutions.drawing_utils
+    return mpHands
+
+
+# Toolbar buttons: label, x range, border colour, label x position, action
+# and its argument. The same table renders the toolbar and hit-tests the
+# fingertip.
+Button = namedtuple('Button', 'label x0 x1 color text_x action value')
+
+
+def layout_toolbar(buttons, width, margin=10, gap=8):
+    """Buttons of one size side by side across ``width`` pixels, labels
+    centred; ``buttons`` are (label, colour, action, value)"""
+    size = (width - 2 * margin - (len(buttons) - 1) * gap) // len(buttons)
+    table = []
+    for i, (label, color, action, value) in enumerate(buttons):
+        x0 = margin + i * (size + gap)
+        (text_width, _), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
+        table.append(Button(label, x0, x0 + size, color, x0 + (size - text_width) // 2, action, value))
+    return table
+
+
+TOOLBAR_BUTTONS = layout_toolbar([
+    ("CLEAR", (0, 0, 0), 'clear', None),
+    ("BLUE", (255, 0, 0), 'color', 0),
+    ("GREEN", (0, 255, 0), 'color', 1),
+    ("RED", (0, 0, 255), 'color', 2),
+    ("YELLOW", (0, 255, 255), 'color', 3),
+    ("FILL", (255, 255, 255), 'fill', None),
+    ("SHAPE", (0, 0, 0), 'shape', None),  # Cycles through shapes
+], canvas_width)
+TOOLBAR_BOTTOM = 65  # Fingertips at or above this row are on the toolbar
+TOOLBAR_HEIGHT = 67  # Rows the toolbar graphics cover, including the border
+
+
+def render_toolbar(width):
+    """Render the toolbar once into a BGRA sprite; alpha marks the drawn pixels"""
+    sprite = np.zeros((TOOLBAR_HEIGHT, width, 4), np.uint8)
+    for button in TOOLBAR_BUTTONS:
+        cv2.rectangle(sprite, (button.x0, 1), (button.x1, TOOLBAR_BOTTOM), button.color + (255,), 2)
+        cv2.putText(sprite, button.label, (button.text_x, 33), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    (0, 0, 0, 255), 2, cv2.LINE_AA)
+    return sprite
+
+
+toolbar_sprite = render_toolbar(canvas_width)
+toolbar_bgr = np.ascontiguousarray(toolbar_sprite[..., :3])
+toolbar_where = (toolbar_sprite[..., 3] > 0)[..., None]
+
+
+def draw_toolbar(image):
+    """Blit the prerendered toolbar onto the top rows of an image"""
+    np.copyto(image[:TOOLBAR_HEIGHT], toolbar_bgr, where=toolbar_where)
+    return image
+
+
+def hit_test(point):
+    """Return the toolbar button under a point, or None"""
+    x, y = point
+    if y > TOOLBAR_BOTTOM:
+        return None
+    for button in TOOLBAR_BUTTONS:
+        if button.x0 <= x <= button.x1:
+            return button
+    return None
+
+
+def draw_shape(image, shape, center, color, size=20):
+    """Stamp a shape tool (1 circle, 2 square, 3 triangle) centred on a point"""
+    x, y = center
+    if shape == 1:
+        cv2.circle(image, center, size, color, -1)
+    elif shape == 2:
+        top_left = (x - size, y - size)
+        bottom_right = (x + size, y + size)
+        cv2.rectangle(image, top_left, bottom_right, color, -1)
+    elif shape == 3:
+        points = np.array([[x, y - size], [x - size, y + size], [x + size, y + size]], np.int32)
+        cv2.fillPoly(image, [points], color)
+
+
+def draw_fill(image, polygon, color, width):
+    """Fill a closed stroke and redraw its outline over the fill"""
+    # cv2 polygon functions only take int32 points
+    polygon = polygon.astype(np.int32)
+    cv2.fillPoly(image, [polygon], color)
+    cv2.polylines(image, [polygon], isClosed=True, color=color, thickness=width)
+
+
+# Smoothed strokes are drawn as uniform Catmull-Rom curves through the raw
+# samples, evaluated at SPLINE_STEPS points per segment. Row k of the basis
+# weighs the four control points at t = k / SPLINE_STEPS.
+SPLINE_STEPS = 8
+_t = np.linspace(0, 1, SPLINE_STEPS + 1)[:, None]
+SPLINE_BASIS = 0.5 * np.hstack((-_t ** 3 + 2 * _t ** 2 - _t,
+                                3 * _t ** 3 - 5 * _t ** 2 + 2,
+                                -3 * _t ** 3 + 4 * _t ** 2 + _t,
+                                _t ** 3 - _t ** 2))
+
+
+def catmull_rom(controls):
+    """Evaluate a batch of segments: (m, 4, 2) control points, the point before,
+    the start, the end and the point after each segment, to (m, SPLINE_STEPS + 1, 2)"""
+    return np.einsum('sk,mkd->msd', SPLINE_BASIS, controls)
+
+
+def spline_controls(stroke, closing=False):
+    """Control points of the last segment of a stroke that can be drawn.
+
+    The curve into a sample depends on the sample after it, so while the
+    stroke is open its last segment is drawn when the next sample arrives,
+    and by the pen up (``closing``) that ends the stroke.
+    """
+    n = len(stroke)
+    if closing:
+        if n < 2:
+            return None
+        return stroke[[max(n - 3, 0), n - 2, n - 1, n - 1]]
+    if n < 3:
+        return None
+    return stroke[[max(n - 4, 0), n - 3, n - 2, n - 1]]
+
+
+def spline_path(stroke):
+    """Dense points along the whole curve through a stroke's samples"""
+    if len(stroke) < 3:
+        return stroke
+    padded = np.concatenate((stroke[:1], stroke, stroke[-1:])).astype(np.float64)
+    controls = np.lib.stride_tricks.sliding_window_view(padded, (4, 2))[:, 0]
+    curve = catmull_rom(controls)
+    return np.concatenate((curve[:, :-1].reshape(-1, 2), stroke[-1:]))
+
+
+def split_long(lines, limit):
+    """Split polylines that span more than ``limit`` pixels into short straight
+    pieces, so that none of them needs a large drawing area"""
+    extent = (lines.max(axis=1) - lines.min(axis=1)).max(axis=1)
+    if (extent <= limit).all():
+        return lines
+    pieces = list(lines[extent <= limit])
+    for line in lines[extent > limit]:
+        for a, b in zip(line[:-1], line[1:]):
+            n = max(1, math.ceil(np.abs(b - a).max() * 2 / limit))
+            points = np.rint(a + (b - a) * np.linspace(0, 1, n + 1)[:, None]).astype(np.int32)
+            pieces.extend(points[j:j + 2] for j in range(n))
+    return pieces
+
+
+def stroke_painter(lines, color, width):
+    """A paint function for SparseCanvas.draw and LayerTiles.draw that draws
+    polylines into the paint, the stroke layer and its mask"""
+    def paint(layers, offset):
+        shifted = lines - np.int32(offset)
+        cv2.polylines(layers[0], shifted, False, color, width)
+        cv2.polylines(layers[1], shifted, False, color, width)
+        cv2.polylines(layers[2], shifted, False, 1, width)
+    return paint
+
+
+# Strokes, fills and stamps are numbered as they are painted, across all
+# pens, so that exports can stack them the way the canvas does
+paint_order = itertools.count()
+
+
+class StrokeStore:
+    """Freehand strokes packed into one growable int16 point buffer.
+
+    Stroke i owns ``points[offsets[i]:offsets[i + 1]]`` and has its own
+    colour, width and place in the paint order. Strokes are only created
+    when drawing starts, and buffers double in size when full, so no point
+    is ever dropped.
+    """
+
+    def __init__(self, capacity=4096, stroke_capacity=256):
+        self.points = np.empty((capacity, 2), np.int16)
+        self.offsets = np.zeros(stroke_capacity + 1, np.int64)
+        self.colors = np.empty((stroke_capacity, 3), np.uint8)
+        self.widths = np.empty(stroke_capacity, np.uint8)
+        self.order = np.empty(stroke_capacity, np.int64)
+        self.count = 0  # Number of strokes
+        self.size = 0  # Number of points
+        self.open = False  # Whether the last stroke still takes points
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.count = 0
+        self.size = 0
+        self.open = False
+
+    def begin(self, color, width=2):
+        """Start a new stroke and return its index"""
+        if self.count == len(self.widths):
+            grow = len(self.widths)
+            self.offsets = np.concatenate((self.offsets, np.zeros(grow, np.int64)))
+            self.colors = np.concatenate((self.colors, np.empty((grow, 3), np.uint8)))
+            self.widths = np.concatenate((self.widths, np.empty(grow, np.uint8)))
+            self.order = np.concatenate((self.order, np.empty(grow, np.int64)))
+        self.colors[self.count] = color
+        self.widths[self.count] = width
+        self.order[self.count] = next(paint_order)
+        self.count += 1
+        self.offsets[self.count] = self.size
+        self.open = True
+        return self.count - 1
+
+    def end(self):
+        """Close the current stroke; returns its index, or None if none was open"""
+        if not self.open:
+            return None
+        self.open = False
+        return self.count - 1
+
+    def append(self, point):
+        """Add a point to the open stroke; returns the previous point or None"""
+        if self.size == len(self.points):
+            self.points = np.concatenate((self.points, np.empty_like(self.points)))
+        start = self.offsets[self.count - 1]
+        previous = tuple(int(v) for v in self.points[self.size - 1]) if self.size > start else None
+        self.points[self.size] = point
+        self.size += 1
+        self.offsets[self.count] = self.size
+        return previous
+
+    def stroke(self, i):
+        """The points of stroke i, as a contiguous view"""
+        return self.points[self.offsets[i]:self.offsets[i + 1]]
+
+    def color(self, i):
+        return tuple(int(c) for c in self.colors[i])
+
+
+# What undo restores for a pen. Strokes and stamps are only ever appended
+# to (clearing swaps in new ones), so counts into them are enough. Pens
+# are always lifted after an undo or redo.
+PenState = namedtuple('PenState', 'strokes count size stamps stamp_count filled')
+
+
+class Pen:
+    """Tool selection and strokes of one hand."""
+
+    def __init__(self):
+        self.strokes = StrokeStore()
+        self.stamps = []  # (shape, center, color, paint order) for each shape tool stamp
+        self.colorIndex = 0
+        self.shapeIndex = 0  # 0 for Freehand, 1 for Circle, 2 for Rectangle, 3 for Triangle
+        self.fill_mode = False
+        # Strokes are filled once, when they are closed; the paint order of
+        # the fill of each stroke already filled, by stroke index
+        self.filled = {}
+        self.anchor = None  # Where a two-finger pan and zoom started
+
+    def clear(self):
+        # New containers rather than emptied ones, so undo can bring the old ones back
+        self.strokes = StrokeStore()
+        self.stamps = []
+        self.filled = {}
+
+    def state(self):
+        strokes = self.strokes
+        return PenState(strokes, strokes.count, strokes.size,
+                        self.stamps, len(self.stamps), dict(self.filled))
+
+    def restore(self, state):
+        self.strokes = state.strokes
+        self.strokes.count, self.strokes.size, self.strokes.open = state.count, state.size, False
+        self.stamps = state.stamps[:state.stamp_count]
+        self.filled = dict(state.filled)
+
+
+class LayerTiles:
+    """Fixed size image layers, seen as a grid of tiles for TileHistory."""
+
+    def __init__(self, layers, tile=32):
+        self.layers = layers
+        self.base = [layer.copy() for layer in layers]
+        self.tile = tile
+        height, width = layers[0].shape[:2]
+        self.dirty = np.zeros((-(-height // tile), -(-width // tile)), bool)
+
+    def mark(self, x0, y0, x1, y1):
+        """Mark the tiles under a rectangle, in pixels, as changed"""
+        t = self.tile
+        self.dirty[max(0, y0 // t):max(0, y1 // t + 1), max(0, x0 // t):max(0, x1 // t + 1)] = True
+
+    def mark_all(self):
+        self.dirty[:] = True
+
+    def take_dirty(self):
+        keys = list(zip(*np.nonzero(self.dirty)))
+        self.dirty[:] = False
+        return keys
+
+    def rebase(self):
+        """Take the layers as they are as the base of the next step"""
+        for base, layer in zip(self.base, self.layers):
+            base[...] = layer
+
+    def draw(self, boxes, paint, mark=True):
+        """Run ``paint(layers, offset)`` once, marking each (x0, y0, x1, y1) box
+        unless ``mark`` is False"""
+        if mark:
+            for box in boxes:
+                self.mark(*box)
+        paint(self.layers, (0, 0))
+
+    def _regions(self, images, key):
+        y, x = key
+        t = self.tile
+        return [image[y * t:(y + 1) * t, x * t:(x + 1) * t] for image in images]
+
+    def regions(self, key):
+        return self._regions(self.layers, key)
+
+    def base_regions(self, key):
+        return self._regions(self.base, key)
+
+    def touched(self, key):
+        pass
+
+
+class TileHistory:
+    """Undo and redo that stores only the tiles each step changed.
+
+    The tiles come from a surface (LayerTiles or SparseCanvas) that drawing
+    code marks as it draws, and that keeps a copy of every tile as of the
+    last commit. commit() keeps the before and after contents of the marked
+    tiles that really changed, zlib compressed, together with the owner's
+    state. Only the last ``levels`` steps are kept.
+    """
+
+    def __init__(self, surface, state, levels=256, compress=True):
+        self.surface = surface
+        self.state = state
+        self.compress = compress
+        self.undo_steps = deque(maxlen=levels)
+        self.redo_steps = []
+
+    def pack(self, tiles):
+        # Layer by layer, which compresses better than tile by tile
+        data = b"".join(layers[i].tobytes() for i in range(len(tiles[0]) if tiles else 0)
+                        for layers in tiles)
+        return zlib.compress(data, 1) if self.compress else data
+
+    def unpack(self, data, keys):
+        """Write packed tiles back into both the surface and its base copy"""
+        if self.compress:
+            data = zlib.decompress(data)
+        surface = self.surface
+        tiles = [(surface.regions(key), surface.base_regions(key)) for key in keys]
+        offset = 0
+        for i in range(len(tiles[0][0]) if tiles else 0):
+            for regions, bases in tiles:
+                region = regions[i]
+                tile = np.frombuffer(data, region.dtype, region.size, offset).reshape(region.shape)
+                region[...] = tile
+                bases[i][...] = tile
+                offset += region.nbytes
+        for key in keys:
+            surface.touched(key)
+
+    def commit(self, state):
+        """Close the current step, ending in ``state``; returns False, keeping
+        no step, when neither the tiles nor the state changed"""
+        surface = self.surface
+        keys = [key for key in surface.take_dirty()
+                if any(not np.array_equal(region, base)
+                       for region, base in zip(surface.regions(key), surface.base_regions(key)))]
+        if not keys and state == self.state:
+            return False
+        before = self.pack([surface.base_regions(key) for key in keys])
+        after = self.pack([surface.regions(key) for key in keys])
+        for key in keys:
+            for region, base in zip(surface.regions(key), surface.base_regions(key)):
+                base[...] = region
+        self.undo_steps.append((keys, before, after, self.state, state))
+        self.redo_steps.clear()
+        self.state = state
+        return True
 
+    def undo(self):
+        """Roll back one step; returns the state to restore, or None"""
+        if not self.undo_steps:
+            return None
+        step = self.undo_steps.pop()
+        keys, before, after, before_state, after_state = step
+        self.unpack(before, keys)
+        self.redo_steps.append(step)
+        self.state = before_state
+        return before_state
+
+    def redo(self):
+        """Reapply the last undone step; returns the state to restore, or None"""
+        if not self.redo_steps:
+            return None
+        step = self.redo_steps.pop()
+        keys, before, after, before_state, after_state = step
+        self.unpack(after, keys)
+        self.undo_steps.append(step)
+        self.state = after_state
+        return after_state
+
+    def reset(self, state):
+        """Forget every step, starting again from the surface as it is"""
+        self.surface.take_dirty()
+        self.surface.rebase()
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+        self.state = state
+
+    def nbytes(self):
+        """Memory held by the undo and redo steps"""
+        return sum(len(step[1]) + len(step[2]) for step in (*self.undo_steps, *self.redo_steps))
+
+
+class SparseCanvas:
+    """An unbounded canvas of square tiles, allocated only where something is drawn.
+
+    A tile holds the same three layers as the fixed canvas: the paint, and
+    the stroke layer and mask overlaid on the webcam. Zoomed out views are
+    composited from downsampled tiles, cached per mip level and rebuilt
+    when their tile changes. For TileHistory the tiles are split into
+    smaller blocks, so an undo step only stores the blocks it changed.
+    """
+
+    def __init__(self, tile=256, block=32, max_level=4):
+        self.tile = tile
+        self.block = block
+        self.max_level = max_level
+        self.tiles = {}  # (tx, ty) -> [paint, layer, mask]
+        self.base = {}  # Tiles as of the last undo step
+        self.versions = {}
+        self.mips = {}  # (level, tx, ty) -> (version, [paint, layer, mask])
+        self.dirty = set()  # Blocks, as (bx, by)
+        self.version = 0  # Bumped on every change, so views know to re-render
+
+    def blank(self):
+        t = self.tile
+        return [np.full((t, t, 3), 255, np.uint8), np.zeros((t, t, 3), np.uint8), np.zeros((t, t), np.uint8)]
+
+    def keys(self, x0, y0, x1, y1, size=None):
+        """The (x, y) indices of the tiles, or of the blocks of ``size``, under a rectangle"""
+        t = size or self.tile
+        return [(tx, ty) for ty in range(y0 // t, y1 // t + 1) for tx in range(x0 // t, x1 // t + 1)]
+
+    def mark(self, x0, y0, x1, y1):
+        self.dirty.update(self.keys(x0, y0, x1, y1, self.block))
+
+    def mark_all(self):
+        t = self.tile - 1
+        for tx, ty in self.tiles:
+            self.mark(tx * self.tile, ty * self.tile, tx * self.tile + t, ty * self.tile + t)
+
+    def take_dirty(self):
+        keys = list(self.dirty)
+        self.dirty.clear()
+        return keys
+
+    def rebase(self):
+        """Take the tiles as they are as the base of the next step"""
+        for key, layers in self.tiles.items():
+            for base, layer in zip(self.base[key], layers):
+                base[...] = layer
+
+    def tile_layers(self, key):
+        if key not in self.tiles:
+            self.tiles[key] = self.blank()
+            self.base[key] = self.blank()
+        return self.tiles[key]
+
+    def _block(self, tiles, key):
+        per_tile = self.tile // self.block
+        tile = (key[0] // per_tile, key[1] // per_tile)
+        self.tile_layers(tile)
+        x, y = (key[0] % per_tile) * self.block, (key[1] % per_tile) * self.block
+        return [layer[y:y + self.block, x:x + self.block] for layer in tiles[tile]]
+
+    def regions(self, key):
+        return self._block(self.tiles, key)
+
+    def base_regions(self, key):
+        return self._block(self.base, key)
+
+    def touched(self, key):
+        """A block was written by undo or redo"""
+        per_tile = self.tile // self.block
+        self.changed((key[0] // per_tile, key[1] // per_tile))
+
+    def changed(self, tile):
+        self.versions[tile] = self.versions.get(tile, 0) + 1
+        self.version += 1
+
+    def draw(self, boxes, paint, mark=True):
+        """Run ``paint(layers, offset)`` over each (x0, y0, x1, y1) box, with
+        ``offset`` the world position of the layers' top left pixel. The
+        boxes are marked for TileHistory unless ``mark`` is False.
+
+        OpenCV rasterises a clipped line slightly differently from the same
+        line drawn whole, so painting tile by tile would leave seams. Boxes up
+        to two tiles across are painted into a scratch copy of the region
+        instead; larger ones, such as big fills, fall back to tile by tile.
+        """
+        t = self.tile
+        for x0, y0, x1, y1 in boxes:
+            keys = self.keys(x0, y0, x1, y1)
+            if x1 - x0 <= 2 * t and y1 - y0 <= 2 * t:
+                scratch = [np.empty((y1 - y0 + 1, x1 - x0 + 1) + layer.shape[2:], np.uint8)
+                           for layer in self.blank()]
+                parts = []
+                for key in keys:
+                    tx, ty = key[0] * t, key[1] * t
+                    sx0, sy0 = max(x0, tx), max(y0, ty)
+                    sx1, sy1 = min(x1 + 1, tx + t), min(y1 + 1, ty + t)
+                    parts.append((self.tile_layers(key), (slice(sy0 - ty, sy1 - ty), slice(sx0 - tx, sx1 - tx)),
+                                  (slice(sy0 - y0, sy1 - y0), slice(sx0 - x0, sx1 - x0))))
+                for layers, inside, part in parts:
+                    for dst, src in zip(scratch, layers):
+                        dst[part] = src[inside]
+                paint(scratch, (x0, y0))
+                for layers, inside, part in parts:
+                    for dst, src in zip(layers, scratch):
+                        dst[inside] = src[part]
+            else:
+                for key in keys:
+                    paint(self.tile_layers(key), (key[0] * t, key[1] * t))
+            for key in keys:
+                self.changed(key)
+            if mark:
+                self.mark(x0, y0, x1, y1)
+
+    def clear(self):
+        for key, (paint, layer, mask) in self.tiles.items():
+            paint[:] = 255
+            layer[:] = 0
+            mask[:] = 0
+            self.changed(key)
+        self.mark_all()
+
+    def mip(self, level, key):
+        """The tile's layers downsampled 2**level times, from the cache when current"""
+        if level == 0:
+            return self.tiles[key]
+        version = self.versions.get(key, 0)
+        cached = self.mips.get((level,) + key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        paint, layer, mask = self.mip(level - 1, key)
+        size = paint.shape[0] // 2
+        # Average the stroke colours over the strokes only, not the empty pixels
+        ink = cv2.resize(layer.astype(np.float32) * mask[..., None], (size, size),
+                         interpolation=cv2.INTER_AREA)
+        share = cv2.resize(mask.astype(np.float32), (size, size), interpolation=cv2.INTER_AREA)
+        layers = [cv2.resize(paint, (size, size), interpolation=cv2.INTER_AREA),
+                  (ink / np.maximum(share, 1e-6)[..., None]).astype(np.uint8),
+                  (share > 0).astype(np.uint8)]
+        self.mips[(level,) + key] = (version, layers)
+        return layers
+
+    def render(self, targets, origin, zoom):
+        """Composite the tiles visible from ``origin`` (the world position of the
+        targets' top left pixel) at ``zoom`` into the target layers"""
+        height, width = targets[2].shape
+        level = min(self.max_level, max(0, int(math.floor(math.log2(1 / zoom)))))
+        size = self.tile >> level
+        scale = zoom * (1 << level)  # Target pixels per pixel of the mip level
+        # The visible rectangle, in pixels of the mip level
+        x0, y0 = int(math.floor(origin[0] / (1 << level))), int(math.floor(origin[1] / (1 << level)))
+        x1, y1 = x0 + math.ceil(width / scale), y0 + math.ceil(height / scale)
+        if (x1 - x0, y1 - y0) == (width, height):
+            crop = targets  # 1:1, so copy the tiles straight into place
+        else:
+            crop = [np.empty((y1 - y0, x1 - x0) + target.shape[2:], np.uint8) for target in targets]
+        crop[0][:] = 255
+        crop[1][:] = 0
+        crop[2][:] = 0
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                if (tx, ty) in self.tiles:
+                    left, top = tx * size, ty * size
+                    cx0, cy0 = max(x0, left), max(y0, top)
+                    cx1, cy1 = min(x1, left + size), min(y1, top + size)
+                    for dst, src in zip(crop, self.mip(level, (tx, ty))):
+                        dst[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0] = src[cy0 - top:cy1 - top, cx0 - left:cx1 - left]
+        if crop is not targets:
+            # Smooth paint; the overlay stays crisp
+            cv2.resize(crop[0], (width, height), dst=targets[0], interpolation=cv2.INTER_LINEAR)
+            cv2.resize(crop[1], (width, height), dst=targets[1], interpolation=cv2.INTER_NEAREST)
+            cv2.resize(crop[2], (width, height), dst=targets[2], interpolation=cv2.INTER_NEAREST)
+
+
+# Hand gestures, as classified by GestureEngine
+(GESTURE_NONE, GESTURE_POINT, GESTURE_PINCH, GESTURE_OPEN_PALM, GESTURE_FIST,
+ GESTURE_TWO_FINGERS) = range(6)
+
+FINGER_TIPS = [8, 12, 16, 20]  # Index, middle, ring and little finger
+FINGER_PIPS = [6, 10, 14, 18]
+
+
+class GestureEngine:
+    """Classifies each hand's pose from its landmarks, for all hands at once.
+
+    A finger counts as extended when its tip is further from the wrist than
+    its middle joint by ``extend`` times, and the hand pinches when the
+    thumb and index tips are closer than ``pinch`` times the size of the
+    palm (wrist to middle finger knuckle). Each test has a pair of
+    thresholds, entered at the first and left at the second, so a pose near
+    the boundary does not flicker. Distances include MediaPipe's depth
+    estimate, which makes them independent of how the hand is turned.
+    """
+
+    def __init__(self, hands=1, extend=(1.2, 1.0), pinch=(0.3, 0.45)):
+        self.extend = extend
+        self.pinch = pinch
+        self.extended = np.zeros((hands, 4), bool)
+        self.pinched = np.zeros(hands, bool)
+        self.gestures = np.zeros(hands, np.int8)
+
+    def update(self, landmarks):
+        """Classify an (n, 21, 3) landmark array with NaN rows for hands not
+        seen; returns the gesture of each hand"""
+        seen = ~np.isnan(landmarks[:, 0, 0])
+        wrist = landmarks[:, :1]
+        tips = np.linalg.norm(landmarks[:, FINGER_TIPS] - wrist, axis=2)
+        pips = np.linalg.norm(landmarks[:, FINGER_PIPS] - wrist, axis=2)
+        palm = np.maximum(np.linalg.norm(landmarks[:, 9] - landmarks[:, 0], axis=1), 1e-6)
+        extension = tips / np.maximum(pips, 1e-6)
+        pinch = np.linalg.norm(landmarks[:, 4] - landmarks[:, 8], axis=1) / palm
+
+        # Comparisons with NaN are false, so unseen hands reset to neither
+        on, off = self.extend
+        self.extended[:] = np.where(self.extended, extension > off, extension > on)
+        on, off = self.pinch
+        self.pinched[:] = np.where(self.pinched, pinch < off, pinch < on)
+
+        index, middle, ring, little = self.extended.T
+        count = self.extended.sum(axis=1)
+        gestures = self.gestures
+        gestures[:] = GESTURE_NONE
+        gestures[seen & (count == 0)] = GESTURE_FIST
+        gestures[count == 4] = GESTURE_OPEN_PALM
+        gestures[index & ~middle & ~ring & ~little] = GESTURE_POINT
+        gestures[index & middle & ~ring & ~little] = GESTURE_TWO_FINGERS
+        gestures[self.pinched] = GESTURE_PINCH
+        return gestures
+
+
+class AirCanvas:
+    """Drawing state: the paint canvas, and a Pen for each hand drawing on it.
+
+    With ``infinite`` set, drawing goes to a SparseCanvas in world
+    coordinates and the left half of the window is a pannable, zoomable view
+    of it, re-rendered when the view or the drawing changes.
+    """
+
+    def __init__(self, hands=1, spline=False, undo_levels=256, infinite=False):
+        self.pens = [Pen() for _ in range(hands)]
+        self.local_hands = hands  # Pens after these draw for other participants
+        self.remote_pens = {}  # Pen index of each (participant, hand)
+        self.drawing_remote = False  # Remote drawing stays out of the undo history
+        self.brush_width = 2
+        self.recorders = []  # Session files and network links the local events go to
+        self.link = None  # CanvasLink to the relay of a shared canvas
+        self.timings = NullTimes()  # Per-stage drawing times, when they are wanted
+        self.spline = spline  # Draw strokes as curves through their samples
+        # Segments that became drawable this frame, by (color, width): a start
+        # and end point each, or four control points when drawing curves
+        self.pending = {}
+
+        # Both halves of the window live in one preallocated uint8 buffer:
+        # the canvas on the left and the webcam view on the right are views
+        # into it, so drawing into them composites the window in place
+        self.combined = np.empty((canvas_height, canvas_width * 2, 3), np.uint8)
+        self.paintWindow = self.combined[:, :canvas_width]  # Canvas size on the left side
+        self.frame_resized = self.combined[:, canvas_width:]
+        self.paintWindow[:] = 255
+        draw_toolbar(self.paintWindow)
+
+        # Freehand strokes are rasterised once, when their points arrive, into a
+        # persistent layer that is composited onto every webcam frame. strokeMask
+        # only holds 0/1 so it can be viewed as a boolean mask without a copy.
+        self.strokeLayer = np.zeros((canvas_height, canvas_width, 3), np.uint8)
+        self.strokeMask = np.zeros((canvas_height, canvas_width), np.uint8)
+        self.strokeWhere = self.strokeMask.view(bool)[..., None]
+
+        # The view of the infinite canvas: the world position of the top left
+        # pixel, and screen pixels per world pixel
+        self.world = SparseCanvas() if infinite else None
+        self.origin = np.zeros(2)
+        self.zoom = 1.0
+        self.rendered_view = None
+        self.gestures = GestureEngine(hands)
+
+        # Each finished stroke, stamp, fill or clear is one undo step
+        layers = [self.paintWindow, self.strokeLayer, self.strokeMask]
+        self.surface = self.world if infinite else LayerTiles(layers)
+        self.history = TileHistory(self.surface, self.pen_states(), levels=undo_levels)
+        self.commit_due = False
+
+    def to_world(self, point):
+        if self.world is None:
+            return point
+        x, y = self.origin + np.array(point) / self.zoom
+        return (int(round(x)), int(round(y)))
+
+    def set_view(self, origin, zoom):
+        zoom = min(8.0, max(1 / 16, zoom))
+        # Session files store world coordinates as int16
+        origin = np.clip(origin, -30000, 30000 - np.array([canvas_width, canvas_height]) / zoom)
+        if zoom != self.zoom or (origin != self.origin).any():
+            # A stroke cannot carry on across a change of view
+            for hand in range(self.local_hands):
+                self.end_stroke(hand)
+            self.origin, self.zoom = origin, zoom
+
+    def zoom_by(self, factor, center=(canvas_width / 2, canvas_height / 2)):
+        """Zoom keeping the world point under ``center`` (screen pixels) in place"""
+        world = self.origin + np.array(center) / self.zoom
+        zoom = self.zoom * factor
+        self.set_view(world - np.array(center) / zoom, zoom)
+
+    def navigate(self, pen, tips):
+        """Two-finger pan and zoom: the world point between the fingertips stays
+        under them, and spreading them apart zooms in steps of a square root of 2"""
+        middle = tips.mean(axis=0)
+        spread = max(float(np.linalg.norm(tips[0] - tips[1])), 1.0)
+        if pen.anchor is None:
+            pen.anchor = (self.origin + middle / self.zoom, spread, self.zoom)
+        world, start_spread, start_zoom = pen.anchor
+        steps = round(2 * math.log2(spread / start_spread))
+        zoom = start_zoom * 2 ** (steps / 2)
+        self.set_view(world - middle / min(8.0, max(1 / 16, zoom)), zoom)
+
+    def refresh_view(self):
+        """Re-render the view of the infinite canvas if it or the view changed"""
+        view = (self.world.version, tuple(self.origin), self.zoom)
+        if view != self.rendered_view:
+            self.world.render([self.paintWindow, self.strokeLayer, self.strokeMask], self.origin, self.zoom)
+            draw_toolbar(self.paintWindow)
+            self.rendered_view = view
+
+    def pen_states(self):
+        return [pen.state() for pen in self.pens[:self.local_hands]]
+
+    def commit(self):
+        start = self.timings.clock()
+        if self.history.commit(self.pen_states()):
+            self.record(EV_COMMIT)
+        self.commit_due = False
+        self.timings.add("commit", self.timings.clock() - start)
+
+    # Undo and redo only rewind the local canvas, so they are off while the
+    # canvas is shared: the participants' canvases would no longer match
+    def undo(self):
+        if self.link is None:
+            self.step(self.history.undo, EV_UNDO)
+
+    def redo(self):
+        if self.link is None:
+            self.step(self.history.redo, EV_REDO)
+
+    def step(self, move, event):
+        # Strokes in progress are finished first, and become the step undone
+        for hand in range(self.local_hands):
+            self.end_stroke(hand)
+        self.draw_pending()
+        if self.commit_due:
+            self.commit()
+        states = move()
+        if states is not None:
+            self.record(event)
+            for pen, state in zip(self.pens, states):
+                pen.restore(state)
+
+    def draw(self, boxes, paint):
+        self.surface.draw(boxes, paint, mark=not self.drawing_remote)
+
+    def draw_pending(self):
+        """Draw this frame's new segments, one call per colour and layer"""
+        if not self.pending:
+            return
+        start = self.timings.clock()
+        for (color, width), segments in self.pending.items():
+            if self.spline:
+                lines = np.rint(catmull_rom(np.array(segments, np.float64))).astype(np.int32)
+            else:
+                lines = np.array(segments, np.int32)
+            if self.world is not None:
+                lines = split_long(lines, self.world.tile)
+            boxes = [(*(line.min(axis=0) - width).tolist(), *(line.max(axis=0) + width).tolist())
+                     for line in lines]
+            self.draw(boxes, stroke_painter(lines, color, width))
+        self.pending.clear()
+        self.timings.add("strokes", self.timings.clock() - start)
+
+    def queue_segment(self, pen, closing=False):
+        """Queue the segment the last sample (or pen up) made drawable"""
+        strokes = pen.strokes
+        i = strokes.count - 1
+        if self.spline:
+            segment = spline_controls(strokes.stroke(i), closing)
+        elif not closing and len(strokes.stroke(i)) > 1:
+            segment = strokes.stroke(i)[-2:]
+        else:
+            segment = None
+        if segment is not None:
+            key = (strokes.color(i), int(strokes.widths[i]))
+            self.pending.setdefault(key, []).append(segment)
+
+    def record(self, event, a=0, b=0, hand=0):
+        if hand < self.local_hands:
+            for recorder in self.recorders:
+                recorder.record(event, a, b, hand)
+
+    def add_point(self, hand, point):
+        self.record(EV_POINT, *point, hand=hand)
+        pen = self.pens[hand]
+        if not pen.strokes.open:
+            pen.strokes.begin(colors[pen.colorIndex], self.brush_width)
+        pen.strokes.append(point)
+        self.queue_segment(pen)
+
+    def clear(self, hand=0):
+        if not any(len(pen.strokes) or pen.stamps for pen in self.pens):
+            return  # Nothing to clear, as on every frame the fingertip rests on CLEAR
+        self.record(EV_CLEAR, hand=hand)
+        for pen in self.pens:
+            pen.clear()
+        self.pending.clear()
+
+        if self.world is not None:
+            self.world.clear()
+        else:
+            self.paintWindow[TOOLBAR_HEIGHT:,:,:] = 255
+            self.strokeLayer[:] = 0
+            self.strokeMask[:] = 0
+            self.surface.mark_all()
+        if self.link is not None or self.remote_pens:
+            # Everyone's canvas was cleared, so no one's undo can go back past
+            # it. Recorded for the first hand, so sessions also get the clears
+            # made by the others
+            self.history.reset(self.pen_states())
+            self.record(EV_RESET)
         else:
-            if shapeIndex == 1:
-                cv2.circle(paintWindow, center, 20, colors[colorIndex], -1)
-            elif shapeIndex == 2:
-                top_left = (center[0] - 20, center[1] - 20)
-                bottom_right = (center[0] + 20, center[1] + 20)
-                cv2.rectangle(paintWindow, top_left, bottom_right, colors[colorIndex], -1)
-            elif shapeIndex == 3:
-                points = np.array([[center[0], center[1] - 20], [center[0] - 20, center[1] + 20], [center[0] + 20, center[1] + 20]])
-                cv2.fillPoly(paintWindow, [points], colors[colorIndex])
+            self.commit_due = True
+
+    def fill_stroke(self, pen, i):
+        stroke = pen.strokes.stroke(i)
+        if len(stroke) > 1 and i not in pen.filled:
+            # Whatever was drawn before the fill goes under it, even when a
+            # participant's frames arrive together and are drawn in one go
+            self.draw_pending()
+            start = self.timings.clock()
+            if self.spline:
+                stroke = np.rint(spline_path(stroke))
+            width, color = int(pen.strokes.widths[i]), pen.strokes.color(i)
+            polygon = stroke.astype(np.int32)
+            (x0, y0), (x1, y1) = polygon.min(axis=0).tolist(), polygon.max(axis=0).tolist()
+            self.draw([(x0 - width, y0 - width, x1 + width, y1 + width)],
+                      lambda layers, offset: draw_fill(layers[0], polygon - offset, color, width))
+            pen.filled[i] = next(paint_order)
+            self.commit_due = True
+            self.timings.add("fill", self.timings.clock() - start)
+
+    def fill_closed(self, pen):
+        """Fill mode was just turned on: fill the strokes finished so far"""
+        closed = len(pen.strokes) - (1 if pen.strokes.open else 0)
+        for i in range(closed):
+            self.fill_stroke(pen, i)
+
+    def end_stroke(self, hand):
+        """Pen up: the hand's current stroke is finished, so fill it if filling"""
+        pen = self.pens[hand]
+        if pen.strokes.open:
+            self.queue_segment(pen, closing=True)
+        i = pen.strokes.end()
+        if i is not None:
+            self.record(EV_PEN_UP, hand=hand)
+            self.commit_due = True
+            if pen.fill_mode:
+                self.fill_stroke(pen, i)
+
+    def stamp(self, hand, center):
+        """Stamp the hand's current shape at a world point"""
+        pen = self.pens[hand]
+        color, shape = colors[pen.colorIndex], pen.shapeIndex
+        (x, y) = center
+        self.record(EV_STAMP, x, y, hand=hand)
+        self.draw([(x - 21, y - 21, x + 21, y + 21)],
+                  lambda layers, offset: draw_shape(layers[0], shape, (x - offset[0], y - offset[1]), color))
+        pen.stamps.append((shape, center, color, next(paint_order)))
+        self.commit_due = True
+
+    def apply_remote(self, peer, records):
+        """Apply another participant's drawing events, (event, a, b) as in
+        session files, each of its hands drawing with a pen of its own.
+        Commits stay local to each participant, and the remote drawing
+        stays out of the local undo steps."""
+        commit_due, self.drawing_remote = self.commit_due, True
+        for event, a, b in records:
+            key = (peer, event >> 4)
+            if key not in self.remote_pens:
+                self.remote_pens[key] = len(self.pens)
+                self.pens.append(Pen())
+            hand = self.remote_pens[key]
+            pen, event = self.pens[hand], event & 0xF
+            if event == EV_POINT:
+                self.add_point(hand, (a, b))
+            elif event == EV_PEN_UP:
+                self.end_stroke(hand)
+            elif event == EV_CLEAR:
+                self.clear(hand)
+            elif event == EV_COLOR:
+                pen.colorIndex = a
+            elif event == EV_FILL:
+                pen.fill_mode = bool(a)
+                if pen.fill_mode:
+                    self.fill_closed(pen)
+            elif event == EV_SHAPE:
+                pen.shapeIndex = a
+            elif event == EV_STAMP:
+                self.stamp(hand, (a, b))
+        self.draw_pending()
+        self.commit_due, self.drawing_remote = commit_due, False
+
+    def use_tool(self, hand, button):
+        """Apply a toolbar button to the hand's pen"""
+        pen = self.pens[hand]
+        action = button.action if button is not None else None
+        if action == 'clear':
+            self.clear(hand)
+        elif action == 'color':
+            pen.colorIndex = button.value
+            self.record(EV_COLOR, pen.colorIndex, hand=hand)
+        elif action == 'fill':
+            pen.fill_mode = not pen.fill_mode  # Toggle fill mode
+            self.record(EV_FILL, int(pen.fill_mode), hand=hand)
+            if pen.fill_mode:
+                self.fill_closed(pen)
+        elif action == 'shape':
+            pen.shapeIndex = (pen.shapeIndex + 1) % 4  # Cycle through shapes
+            self.record(EV_SHAPE, pen.shapeIndex, hand=hand)
+
+    def handle_hands(self, landmarks):
+        """Apply one frame's hand landmarks to the canvas.
+
+        ``landmarks`` is an (n, 21, 3) array of pixel coordinates, row i for
+        the hand drawing with pen i and NaN for hands not seen this frame.
+        Pointing with the index finger draws and picks tools; any other
+        gesture lifts the pen, and two fingers pan and zoom the infinite
+        canvas. Gestures and toolbar tests run on all hands at once, and the
+        new segments are drawn together, one call per colour.
+        """
+        gestures = self.gestures.update(landmarks)
+        hands = np.flatnonzero(~np.isnan(landmarks[:, 8, 0]))
+        fore_fingers = landmarks[hands, 8, :2].astype(np.int32)
+        on_toolbar = fore_fingers[:, 1] <= TOOLBAR_BOTTOM
+
+        for hand, center, gesture, toolbar in zip(hands.tolist(), fore_fingers.tolist(),
+                                                  gestures[hands].tolist(), on_toolbar.tolist()):
+            pen = self.pens[hand]
+            center = tuple(center)
+            navigating = gesture == GESTURE_TWO_FINGERS and self.world is not None
+            if not navigating:
+                pen.anchor = None
+            if navigating:
+                self.end_stroke(hand)
+                self.navigate(pen, landmarks[hand, [8, 12], :2])
+
+            elif gesture != GESTURE_POINT:
+                self.end_stroke(hand)
+
+            elif toolbar:
+                # Reaching for the toolbar ends the stroke
+                self.end_stroke(hand)
+                self.use_tool(hand, hit_test(center))
+
+            elif pen.shapeIndex != 0:
+                self.stamp(hand, self.to_world(center))
             else:
-                if colorIndex == 0:
-                    bpoints[blue_index].appendleft(center)
-                elif colorIndex == 1:
-                    gpoints[green_index].appendleft(center)
-                elif colorIndex == 2:
-                    rpoints[red_index].appendleft(center)
-                elif colorIndex == 3:
-                    ypoints[yellow_index].appendleft(center)
-
-    points = [bpoints, gpoints, rpoints, ypoints]
-    for i in range(len(points)):
-        for j in range(len(points[i])):
-            for k in range(1, len(points[i][j])):
-                if points[i][j][k - 1] is None or points[i][j][k] is None:
-                    continue
-                cv2.line(frame_resized, points[i][j][k - 1], points[i][j][k], colors[i], 2)
-                cv2.line(paintWindow, points[i][j][k - 1], points[i][j][k], colors[i], 2)
-
-    if fill_mode:
-        mask = np.zeros_like(paintWindow)
-        for i in range(len(points)):
-            for j in range(len(points[i])):
-                if len(points[i][j]) > 1:
-                    cv2.polylines(mask, [np.array(points[i][j])], isClosed=True, color=colors[i], thickness=2)
-        for i in range(len(points)):
-            for j in range(len(points[i])):
-                if len(points[i][j]) > 1:
-                    cv2.fillPoly(mask, [np.array(points[i][j])], color=colors[i])
-
-        paintWindow = cv2.bitwise_or(paintWindow, mask)
-
-    # Show both the webcam and paint canvas in the same window
-    combined = np.hstack((paintWindow, frame_resized))  # Horizontal stacking
-    cv2.imshow("Paint", combined)
-
-    if cv2.waitKey(1) == ord('q'):
-        break
-
-cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+                self.add_point(hand, self.to_world(center))
+
+        self.draw_pending()
+        if self.commit_due:
+            self.commit()
+
+    def load_frame(self, frame):
+        """Put a mirrored webcam frame (see mirror_frame) into the right half of
+        the window buffer, unless it was mirrored straight into it"""
+        if frame is not self.frame_resized:
+            np.copyto(self.frame_resized, frame)
+        return self.frame_resized
+
+    def settle(self):
+        """Finish the frame's drawing: the undo step, if one is due"""
+        if self.commit_due:
+            self.commit()
+
+    def render(self, frame_resized):
+        """Composite the strokes onto the webcam view and return the window image"""
+        self.settle()
+        start = self.timings.clock()
+        if self.world is not None:
+            self.refresh_view()
+        # Overlay the already rasterised strokes on the webcam view
+        np.copyto(frame_resized, self.strokeLayer, where=self.strokeWhere)
+        self.timings.add("composite", self.timings.clock() - start)
+
+        # Both the webcam and paint canvas are already in the same buffer
+        return self.combined
+
+
+class SessionPlayer:
+    """Re-renders a recorded session headlessly, at any scale.
+
+    Events are applied as fast as they can be drawn; their timestamps are
+    kept in the file but not waited on.
+    """
+
+    def __init__(self, width, height, scale=1.0, spline=False, hands=1):
+        self.scale = scale
+        self.spline = spline
+        self.image = np.full((round(height * scale), round(width * scale), 3), 255, np.uint8)
+        self.pens = [Pen() for _ in range(hands)]
+        self.brush_width = 2
+        self.tiles = LayerTiles([self.image])
+        self.history = TileHistory(self.tiles, [pen.state() for pen in self.pens], levels=None)
+
+    def mark(self, points, width):
+        """Mark the bounding box of image points, widened by a line width, for undo"""
+        (x0, y0), (x1, y1) = points.min(axis=0).tolist(), points.max(axis=0).tolist()
+        self.tiles.mark(int(x0) - width, int(y0) - width, int(x1) + width, int(y1) + width)
+
+    def to_image(self, point):
+        return (round(point[0] * self.scale), round(point[1] * self.scale))
+
+    def width(self, width):
+        return max(1, round(width * self.scale))
+
+    def fill_stroke(self, pen, i):
+        stroke = pen.strokes.stroke(i)
+        if len(stroke) > 1 and i not in pen.filled:
+            if self.spline:
+                stroke = spline_path(stroke)
+            polygon = np.rint(stroke * self.scale)
+            width = self.width(int(pen.strokes.widths[i]))
+            draw_fill(self.image, polygon, pen.strokes.color(i), width)
+            self.mark(polygon, width)
+            pen.filled[i] = next(paint_order)
+
+    def draw_segment(self, pen, closing=False):
+        """Draw the segment the last sample (or pen up) made drawable, as AirCanvas does"""
+        strokes = pen.strokes
+        i = strokes.count - 1
+        stroke = strokes.stroke(i)
+        color, width = strokes.color(i), self.width(int(strokes.widths[i]))
+        if self.spline:
+            controls = spline_controls(stroke, closing)
+            if controls is not None:
+                curve = np.rint(catmull_rom(controls[None] * self.scale)).astype(np.int32)
+                cv2.polylines(self.image, curve, False, color, width)
+                self.mark(curve[0], width)
+        elif not closing and len(stroke) > 1:
+            start, end = stroke[-2:].tolist()
+            cv2.line(self.image, self.to_image(start), self.to_image(end), color, width)
+            self.mark(np.array((self.to_image(start), self.to_image(end))), width)
+
+    def apply(self, event, a, b):
+        hand, event = event >> 4, event & 0xF
+        while hand >= len(self.pens):
+            self.pens.append(Pen())
+        pen = self.pens[hand]
+        if event == EV_POINT:
+            if not pen.strokes.open:
+                pen.strokes.begin(colors[pen.colorIndex], self.brush_width)
+            pen.strokes.append((a, b))
+            self.draw_segment(pen)
+        elif event == EV_PEN_UP:
+            if pen.strokes.open:
+                self.draw_segment(pen, closing=True)
+            i = pen.strokes.end()
+            if i is not None and pen.fill_mode:
+                self.fill_stroke(pen, i)
+        elif event in (EV_CLEAR, EV_RESET):
+            for other in self.pens:
+                other.clear()
+            self.image[:] = 255
+            self.tiles.mark_all()
+            if event == EV_RESET:
+                self.history.reset([pen.state() for pen in self.pens])
+        elif event == EV_COLOR:
+            pen.colorIndex = a
+        elif event == EV_FILL:
+            pen.fill_mode = bool(a)
+            if pen.fill_mode:
+                closed = len(pen.strokes) - (1 if pen.strokes.open else 0)
+                for i in range(closed):
+                    self.fill_stroke(pen, i)
+        elif event == EV_SHAPE:
+            pen.shapeIndex = a
+        elif event == EV_STAMP:
+            color = colors[pen.colorIndex]
+            center = self.to_image((a, b))
+            draw_shape(self.image, pen.shapeIndex, center, color, self.width(20))
+            self.mark(np.array([center]), self.width(20) + 1)
+            pen.stamps.append((pen.shapeIndex, (a, b), color, next(paint_order)))
+        elif event == EV_COMMIT:
+            self.history.commit([pen.state() for pen in self.pens])
+        elif event in (EV_UNDO, EV_REDO):
+            states = self.history.undo() if event == EV_UNDO else self.history.redo()
+            for pen, state in zip(self.pens, states or ()):
+                pen.restore(state)
+
+
+def replay(args):
+    """Headless replay of a recorded session into a PNG and/or SVG"""
+    width, height, records = read_session(args.replay)
+    start = time.perf_counter()
+    hands = max((event >> 4 for event, t, a, b in records), default=0) + 1
+    player = SessionPlayer(width, height, scale=args.scale, spline=args.spline, hands=hands)
+    for event, t, a, b in records:
+        player.apply(event, a, b)
+    elapsed = time.perf_counter() - start
+    duration = records[-1][1] / 1000 if records else 0
+    print(f"Replayed {len(records)} events ({duration:.1f} s of drawing) in {elapsed * 1000:.1f} ms")
+    if args.output:
+        cv2.imwrite(args.output, player.image)
+    if args.svg:
+        export_svg(player, args.svg, width, height, fit=args.infinite)
+
+
+class StageTimes:
+    """Rolling per-stage timings, in seconds; ``window=None`` keeps them all."""
+
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self, window=300):
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+            self.samples[stage].append(seconds)
+            self.counts[stage] += 1
+
+    def summary(self, last=None):
+        """Per-stage statistics in milliseconds over the samples kept, or the
+        ``last`` few of them"""
+        with self.lock:
+            samples = {stage: np.array(times)[-last if last else None:] * 1000
+                       for stage, times in self.samples.items() if times}
+            counts = dict(self.counts)
+        stats = {}
+        for stage, ms in samples.items():
+            p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+            stats[stage] = {'count': counts[stage], 'mean': float(ms.mean()), 'p50': float(p50),
+                            'p95': float(p95), 'p99': float(p99), 'max': float(ms.max())}
+        return stats
+
+    def report(self, elapsed):
+        frames = self.counts.get('display', 0)
+        print(f"{frames / elapsed:.1f} FPS over {elapsed:.1f} s ({frames} frames)")
+        for stage, s in self.summary().items():
+            print(f"{stage:>10}: mean {s['mean']:7.2f}  p50 {s['p50']:7.2f}  p95 {s['p95']:7.2f}"
+                  f"  p99 {s['p99']:7.2f}  max {s['max']:7.2f} ms")
+
+    def export(self, path, elapsed):
+        """Write the statistics to a JSON file, or CSV if the name ends in .csv"""
+        frames = self.counts.get('display', 0)
+        stats = self.summary()
+        with open(path, 'w', newline='') as f:
+            if path.lower().endswith('.csv'):
+                writer = csv.writer(f)
+                writer.writerow(['stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'])
+                for stage, s in stats.items():
+                    writer.writerow([stage, s['count']] + [round(s[k], 3) for k in
+                                                            ('mean', 'p50', 'p95', 'p99', 'max')])
+            else:
+                json.dump({'frames': frames, 'seconds': elapsed, 'fps': frames / elapsed,
+                           'stages_ms': stats}, f, indent=2)
+
+
+class NullTimes:
+    """Stands in for StageTimes when instrumentation is off; every call does nothing."""
+
+    @staticmethod
+    def clock():
+        return 0.0
+
+    @staticmethod
+    def add(stage, seconds):
+        pass
+
+
+class PerformanceHud:
+    """Draws FPS and per-stage p50/p95 times over the webcam half of the window.
+
+    Percentiles are over the last ``window`` samples of each stage. The
+    text is recomputed every ``every`` frames, since the percentiles cost
+    more than drawing it.
+    """
+
+    def __init__(self, timings, every=15, window=300):
+        self.timings = timings
+        self.every = every
+        self.window = window
+        self.frame = 0
+        self.shown = deque(maxlen=60)  # When the last frames were shown, for the FPS
+        self.lines = []
+
+    def draw(self, image):
+        self.shown.append(time.perf_counter())
+        if self.frame % self.every == 0:
+            span = self.shown[-1] - self.shown[0]
+            fps = (len(self.shown) - 1) / span if span > 0 else 0.0
+            self.lines = [f"{fps:5.1f} FPS        p50    p95 ms"]
+            self.lines += [f"{stage:>10} {s['p50']:6.2f} {s['p95']:6.2f}"
+                           for stage, s in self.timings.summary(last=self.window).items()]
+        self.frame += 1
+        x, top = canvas_width + 10, TOOLBAR_HEIGHT + 5
+        image[top:top + 18 * len(self.lines) + 6, x - 5:x + 240] //= 3  # Darken behind the text
+        for i, line in enumerate(self.lines):
+            cv2.putText(image, line, (x, top + 18 * (i + 1)), cv2.FONT_HERSHEY_PLAIN, 1.1,
+                        (255, 255, 255), 1, cv2.LINE_AA)
+
+
+class LatestSlot:
+    """A one-slot queue that drops the oldest item, so readers always get the freshest frame.
+
+    With ``lossless`` set, put() waits for the slot instead, for offline
+    inputs where every frame should be processed.
+    """
+
+    def __init__(self, lossless=False):
+        self.queue = queue.Queue(maxsize=1)
+        self.lossless = lossless
+        self.dropped = 0
+
+    def put(self, item):
+        if self.lossless:
+            self.queue.put(item)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+
+class OneEuroFilter:
+    """One-Euro low-pass filter over an array of points (Casiez et al., 2012).
+
+    Slow movements are smoothed heavily to remove jitter, fast ones lightly
+    to keep latency low. The filtered velocity is kept for prediction.
+    """
+
+    def __init__(self, min_cutoff=1.5, beta=0.01, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.velocity = None
+        self.t = None
+
+    @staticmethod
+    def alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def filter(self, value, t):
+        if self.value is None:
+            self.value = value.astype(np.float64)
+            self.velocity = np.zeros_like(self.value)
+            self.t = t
+            return self.value
+        dt = max(t - self.t, 1e-3)
+        velocity = (value - self.value) / dt
+        a_d = self.alpha(self.d_cutoff, dt)
+        self.velocity = self.velocity + a_d * (velocity - self.velocity)
+        # Per point cutoff, driven by that point's speed
+        speed = np.linalg.norm(self.velocity, axis=1, keepdims=True)
+        a = self.alpha(self.min_cutoff + self.beta * speed, dt)
+        self.value = self.value + a * (value - self.value)
+        self.t = t
+        return self.value
+
+    def predict(self, t, horizon=0.2):
+        """Constant-velocity extrapolation from the last filtered value"""
+        return self.value + self.velocity * min(t - self.t, horizon)
+
+
+class HandTracker:
+    """Runs MediaPipe on every Nth frame and predicts the hand in between.
+
+    With ``adaptive`` set, N follows the measured inference latency so that
+    inference takes about ``budget`` of the frame time, up to ``every``.
+    With ``smoothing`` set, landmarks go through a One-Euro filter, which is
+    also what the in-between predictions extrapolate from.
+
+    Inference can run on a downscaled frame (``scale``) and, with ``roi``
+    set, on a crop around the last known hands that doubles in size each
+    time they are lost. Landmarks are mapped back to full-frame
+    coordinates either way.
+
+    Up to ``max_hands`` hands are tracked. Each keeps its slot, and so its
+    pen, from frame to frame by matching wrists to where they were last.
+    """
+
+    def __init__(self, hands, every=1, adaptive=False, smoothing=False, budget=0.5,
+                 scale=1.0, roi=False, roi_margin=0.5, roi_min_size=160, max_hands=1):
+        self.hands = hands
+        self.max_hands = max_hands
+        self.wrists = np.full((max_hands, 2), np.nan)  # Last wrist position of each slot
+        self.normalised = np.empty((max_hands, 21, 3))  # Landmarks as MediaPipe reports them
+        self.scale = scale
+        self.roi = roi
+        self.roi_margin = roi_margin
+        self.roi_min_size = roi_min_size
+        self.roi_box = None
+        self.every = every
+        self.adaptive = adaptive
+        self.budget = budget
+        self.filters = [OneEuroFilter() for _ in range(max_hands)] if smoothing else None
+        self.buffers = {}  # Inference input images, reused while their size holds
+        self.interval = every
+        self.countdown = 0
+        self.latency = None
+        self.frame_time = None
+        self.last_t = None
+
+    def _update_interval(self, t):
+        if self.last_t is not None:
+            dt = t - self.last_t
+            self.frame_time = dt if self.frame_time is None else 0.9 * self.frame_time + 0.1 * dt
+        self.last_t = t
+        if self.adaptive and self.latency and self.frame_time:
+            wanted = math.ceil(self.latency / (self.budget * self.frame_time))
+            self.interval = max(1, min(self.every, wanted))
+
+    def _buffer(self, name, shape):
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self.buffers[name] = np.empty(shape, np.uint8)
+        return buffer
+
+    def _inference_input(self, frame):
+        """Crop and downscale the BGR frame; returns the RGB input and the crop box.
+
+        Only the downscaled crop is converted to RGB.
+        """
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = self.roi_box if self.roi_box is not None else (0, 0, width, height)
+        crop = frame[y0:y1, x0:x1]
+        if self.scale != 1.0:
+            size = (max(1, round((x1 - x0) * self.scale)), max(1, round((y1 - y0) * self.scale)))
+            crop = cv2.resize(crop, size, dst=self._buffer('scaled', (size[1], size[0], 3)),
+                              interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(crop, cv2.COLOR_BGR2RGB, dst=self._buffer('rgb', crop.shape)), (x0, y0, x1, y1)
+
+    def _update_roi(self, points, width, height):
+        """Box the next crop around the hand, or grow it if the hand was lost"""
+        if points is None:
+            if self.roi_box is None:
+                return
+            x0, y0, x1, y1 = self.roi_box
+            cx, cy, half = (x0 + x1) / 2, (y0 + y1) / 2, max(x1 - x0, y1 - y0)
+        else:
+            (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+            cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+            half = max(max(x1 - x0, y1 - y0) * (0.5 + self.roi_margin), self.roi_min_size / 2)
+        box = (max(0, int(cx - half)), max(0, int(cy - half)),
+               min(width, int(cx + half)), min(height, int(cy + half)))
+        # A crop that covers the whole frame saves nothing
+        self.roi_box = None if box == (0, 0, width, height) else box
+
+    def _assign_slots(self, wrists):
+        """Slot index for each detected hand: the nearest free slot that had a
+        hand last time, or else the first empty slot"""
+        distance = np.linalg.norm(wrists[:, None] - self.wrists[None], axis=2)
+        distance[np.isnan(distance)] = np.inf
+        slots = np.full(len(wrists), -1)
+        free = np.ones(self.max_hands, bool)
+        # Closest pairs first
+        for flat in np.argsort(distance, axis=None).tolist():
+            hand, slot = divmod(flat, self.max_hands)
+            if np.isinf(distance[hand, slot]):
+                break
+            if slots[hand] < 0 and free[slot]:
+                slots[hand] = slot
+                free[slot] = False
+        for hand in np.flatnonzero(slots < 0).tolist():
+            slots[hand] = np.flatnonzero(free)[0]
+            free[slots[hand]] = False
+        return slots
+
+    def track(self, frame, timings):
+        """Return (landmarks, handslms): a (max_hands, 21, 3) array of pixel
+        coordinates (depth on the x scale) with NaN rows for empty slots, and the MediaPipe landmarks
+        in full-frame coordinates (None for predicted frames), or None when no
+        hand is tracked."""
+        t = time.perf_counter()
+        self._update_interval(t)
+
+        if self.countdown > 0 and self.filters is not None and not np.isnan(self.wrists).all():
+            self.countdown -= 1
+            landmarks = np.full((self.max_hands, 21, 3), np.nan)
+            for slot, one_euro in enumerate(self.filters):
+                if one_euro.value is not None:
+                    landmarks[slot] = one_euro.predict(t)
+            timings.add("predict", time.perf_counter() - t)
+            return landmarks, None
+
+        framergb, (x0, y0, x1, y1) = self._inference_input(frame)
+        converted = time.perf_counter()
+        timings.add("convert", converted - t)
+
+        result = self.hands.process(framergb)
+        latency = time.perf_counter() - converted
+        timings.add("inference", latency)
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.countdown = self.interval - 1
+
+        height, width = frame.shape[:2]
+        if not result.multi_hand_landmarks:
+            self.wrists[:] = np.nan
+            if self.filters is not None:
+                for one_euro in self.filters:
+                    one_euro.reset()
+            if self.roi:
+                self._update_roi(None, width, height)
+            return None
+        handslms = result.multi_hand_landmarks[:self.max_hands]
+        # All hands in one array: (hands, 21, 3), normalised to the frame
+        normalised = self.normalised[:len(handslms)]
+        normalised.reshape(-1)[:] = np.fromiter(
+            (v for hand in handslms for lm in hand.landmark for v in (lm.x, lm.y, lm.z)),
+            np.float64, normalised.size)
+        if (x0, y0, x1, y1) != (0, 0, width, height):
+            # Landmarks are normalised to the crop; make them relative to the
+            # frame. Depth is on the same scale as x.
+            normalised *= ((x1 - x0) / width, (y1 - y0) / height, (x1 - x0) / width)
+            normalised[..., :2] += (x0 / width, y0 / height)
+            for hand, points in zip(handslms, normalised.tolist()):
+                for lm, (x, y, _) in zip(hand.landmark, points):
+                    lm.x, lm.y = x, y
+        if self.roi:
+            self._update_roi(normalised[..., :2].reshape(-1, 2) * (width, height), width, height)
+
+        detected = normalised * (webcam_width, webcam_height, webcam_width)
+        slots = self._assign_slots(detected[:, 0, :2])
+        self.wrists[:] = np.nan
+        self.wrists[slots] = detected[:, 0, :2]
+        landmarks = np.full((self.max_hands, 21, 3), np.nan)
+        landmarks[slots] = detected
+        if self.filters is not None:
+            for slot, one_euro in enumerate(self.filters):
+                if np.isnan(self.wrists[slot, 0]):
+                    one_euro.reset()
+                else:
+                    landmarks[slot] = one_euro.filter(landmarks[slot], t)
+        return landmarks, handslms
+
+
+class SyntheticTracker:
+    """Scripted hand landmarks in place of HandTracker, without MediaPipe.
+
+    The script is generated from ``seed`` and cycles through every drawing
+    path: a freehand stroke in each colour, filled strokes, each stamp shape
+    and clearing the canvas, so benchmark runs are reproducible. With
+    several ``hands``, each follows its own script, started at a different
+    point. The hand points with the index finger while the pen is down and
+    pinches to lift it.
+    """
+
+    # Landmarks of a hand about 160 pixels tall, relative to the index
+    # fingertip: pointing, with the thumb out and the other fingers curled
+    POINT_POSE = np.array([
+        (10, 160), (-15, 145), (-30, 125), (-38, 105), (-40, 90),  # Wrist, thumb
+        (-5, 95), (-3, 60), (-1, 30), (0, 0),  # Index finger
+        (12, 95), (15, 75), (14, 92), (12, 105),  # Middle finger
+        (27, 100), (29, 82), (27, 97), (25, 110),  # Ring finger
+        (40, 108), (42, 93), (40, 105), (38, 115),  # Little finger
+    ], np.float64)
+    # The same hand with the thumb tip against the index fingertip
+    PINCH_POSE = POINT_POSE.copy()
+    PINCH_POSE[3:5] = (-25, 40), (-6, 6)
+
+    def __init__(self, width=webcam_width, height=webcam_height, seed=0, hands=1):
+        rng = np.random.default_rng(seed)
+        self.scripts = [self._build_script(width, height, rng) for _ in range(hands)]
+        self.offsets = [len(script) * hand // hands for hand, script in enumerate(self.scripts)]
+        self.frame = 0
+
+    @staticmethod
+    def _build_script(width, height, rng):
+        steps = []  # Fingertip x, y and whether the pen is down
+
+        def tap(action, value=None):
+            button = next(b for b in TOOLBAR_BUTTONS if b.action == action and b.value == value)
+            steps.append(((button.x0 + button.x1) / 2, TOOLBAR_BOTTOM / 2, True))
+            steps.append((width / 2, height / 2, False))  # Lift off the toolbar
+
+        def stroke(frames, turn):
+            cx, cy = rng.uniform(0.3, 0.7) * width, rng.uniform(0.45, 0.7) * height
+            radius = rng.uniform(0.1, 0.2) * height
+            angles = np.linspace(0, turn, frames)
+            jitter = rng.normal(0, 1.5, (frames, 2))
+            for a, (dx, dy) in zip(angles, jitter):
+                steps.append((cx + radius * math.cos(a) + dx, cy + radius * math.sin(a) + dy, True))
+            steps.append((cx, cy, False))
+
+        for value in range(len(colors)):
+            tap('color', value)
+            stroke(60, 1.5 * math.pi)
+        tap('fill')
+        stroke(60, 2 * math.pi)
+        stroke(60, 2 * math.pi)
+        tap('fill')
+        for shape in range(1, 4):
+            tap('shape')
+            for _ in range(5):
+                steps.append((rng.uniform(0.1, 0.9) * width, rng.uniform(0.3, 0.9) * height, True))
+        tap('shape')  # Back to freehand
+        tap('clear')
+        return np.array(steps)
+
+    def track(self, frame, timings):
+        start = time.perf_counter()
+        steps = np.array([script[(self.frame + offset) % len(script)]
+                          for script, offset in zip(self.scripts, self.offsets)])
+        self.frame += 1
+        landmarks = np.zeros((len(steps), 21, 3))
+        landmarks[..., :2] = np.where(steps[:, 2, None, None] > 0, self.POINT_POSE, self.PINCH_POSE)
+        landmarks[..., :2] += steps[:, None, :2]
+        timings.add("track", time.perf_counter() - start)
+        return landmarks, None
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+class ImageSequence:
+    """Reads image files in name order with the VideoCapture read() interface"""
+
+    def __init__(self, paths):
+        if not paths:
+            raise Exception("No images found")
+        self.paths = paths
+        self.index = 0
+
+    def read(self):
+        if self.index >= len(self.paths):
+            return False, None
+        frame = cv2.imread(self.paths[self.index])
+        self.index += 1
+        return frame is not None, frame
+
+    def release(self):
+        pass
+
+
+class BlankCapture:
+    """A fixed number of grey frames, for synthetic runs without an input video"""
+
+    def __init__(self, width, height, frames):
+        self.frame = np.full((height, width, 3), 128, np.uint8)
+        self.remaining = frames
+
+    def read(self):
+        if self.remaining <= 0:
+            return False, None
+        self.remaining -= 1
+        return True, self.frame
+
+    def release(self):
+        pass
+
+
+def open_source(args):
+    """The webcam, or the video file, image directory or glob given by --input"""
+    path = args.input
+    if path is None:
+        if args.synthetic:
+            return BlankCapture(webcam_width, webcam_height, args.frames)
+        cap = cv2.VideoCapture(0)
+        cap.set(3, webcam_width)  # Set webcam width to default size (640)
+        cap.set(4, webcam_height)  # Set webcam height to default size (480)
+        return cap
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS))
+        return ImageSequence([os.path.join(path, name) for name in names])
+    if glob.has_magic(path):
+        return ImageSequence(sorted(glob.glob(path)))
+    # Video files, and printf style sequences such as frames/%04d.png
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise Exception(f"Cannot open {path}")
+    return cap
+
+
+class VideoRecorder:
+    """Encodes window images to a video file on a thread of its own.
+
+    write() copies the image into one of ``buffers`` preallocated frames and
+    queues it for the encoder, which hands the frame back once written.
+    When none is free the encoder has fallen behind and the image is
+    dropped and counted, rather than stalling the caller; with ``lossless``
+    set, write() waits for a free frame instead. An encoding error stops
+    the encoding but not the frames coming back, and is raised by the next
+    write() or close().
+    """
+
+    def __init__(self, path, fps=30.0, size=(canvas_width * 2, canvas_height), buffers=4,
+                 lossless=False):
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+        if not self.writer.isOpened():
+            raise Exception(f"Cannot write video to {path}")
+        self.lossless = lossless
+        self.free = queue.Queue()
+        for _ in range(buffers):
+            self.free.put(np.empty((size[1], size[0], 3), np.uint8))
+        self.filled = queue.Queue()
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._encode, daemon=True)
+        self.thread.start()
+
+    def _encode(self):
+        while True:
+            frame = self.filled.get()
+            if frame is None:
+                break
+            if self.error is None:
+                try:
+                    self.writer.write(frame)
+                    self.written += 1
+                except Exception as e:
+                    self.error = e
+            self.free.put(frame)
+
+    def check(self):
+        if self.error is not None:
+            raise Exception(f"Video encoding failed: {self.error}") from self.error
+
+    def write(self, image):
+        self.check()
+        while True:
+            try:
+                frame = self.free.get(block=self.lossless, timeout=0.5)
+                break
+            except queue.Empty:
+                if not self.lossless:
+                    self.dropped += 1
+                    return
+                if not self.thread.is_alive():
+                    raise Exception("Video encoder stopped")
+        np.copyto(frame, image)
+        self.filled.put(frame)
+
+    def close(self):
+        """Finish encoding the queued frames and close the file"""
+        self.filled.put(None)
+        self.thread.join()
+        self.writer.release()
+        print(f"Video: {self.written} frames written, {self.dropped} dropped")
+        self.check()
+
+
+class FrameOutput:
+    """Sends finished window images to the Paint window, a video file, both or nowhere"""
+
+    def __init__(self, window=True, video=None, fps=30.0, hud=None, lossless=False):
+        self.window = window
+        self.hud = hud  # PerformanceHud drawn over each image, if any
+        self.recorder = None
+        if window:
+            cv2.namedWindow('Paint', cv2.WINDOW_AUTOSIZE)
+        if video:
+            self.recorder = VideoRecorder(video, fps, lossless=lossless)
+
+    def show(self, image):
+        """Returns the key pressed in the window, or -1"""
+        if self.hud is not None:
+            self.hud.draw(image)
+        if self.recorder is not None:
+            self.recorder.write(image)
+        if self.window:
+            cv2.imshow("Paint", image)
+            return cv2.waitKey(1)
+        return -1
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.window:
+            cv2.destroyAllWindows()
+
+
+def mirror_frame(frame, out=None):
+    """Mirror a captured frame at the size of the webcam view, into ``out``
+    if given. Frames of that size are flipped straight into place; others
+    are resized into place and flipped there, so no intermediate image is
+    made either way."""
+    height, width = frame.shape[:2]
+    if (width, height) == (canvas_width, canvas_height):
+        return cv2.flip(frame, 1, dst=out)
+    out = cv2.resize(frame, (canvas_width, canvas_height), dst=out)
+    return cv2.flip(out, 1, dst=out)
+
+
+def process_frame(frame, tracker, timings, out=None):
+    """Mirror a captured frame and run hand tracking on it"""
+    start = time.perf_counter()
+    # The tracker converts only what it feeds to MediaPipe
+    frame = mirror_frame(frame, out)
+    timings.add("mirror", time.perf_counter() - start)
+
+    return frame, tracker.track(frame, timings)
+
+
+def present(canvas, frame, hand, timings, output):
+    """Draw one tracked frame and show it; returns False when the user quits"""
+    start = time.perf_counter()
+    frame_resized = canvas.load_frame(frame)
+
+    # Draw the UI elements
+    frame_resized = draw_toolbar(frame_resized)
+
+    if hand is not None:
+        landmarks, handslms = hand
+        for handlms in handslms or ():
+            mpDraw.draw_landmarks(frame_resized, handlms, mpHands.HAND_CONNECTIONS)
+
+        canvas.handle_hands(landmarks)
+
+    if canvas.link is not None:
+        for peer, records in canvas.link.exchange():
+            canvas.apply_remote(peer, records)
+
+    combined = canvas.render(frame_resized)
+    drawn = time.perf_counter()
+    key = output.show(combined)
+    timings.add("render", drawn - start)
+    timings.add("display", time.perf_counter() - drawn)
+    if key == ord('z'):
+        canvas.undo()
+    elif key == ord('y'):
+        canvas.redo()
+    elif key in (ord('+'), ord('=')):
+        canvas.zoom_by(2 ** 0.5)
+    elif key == ord('-'):
+        canvas.zoom_by(2 ** -0.5)
+    elif key == ord('0'):
+        canvas.set_view(np.zeros(2), 1.0)
+    return key != ord('q')
+
+
+def run_sequential(cap, tracker, canvas, timings, output):
+    while True:
+        start = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            break
+        timings.add("capture", time.perf_counter() - start)
+
+        # Mirrored straight into the window buffer, which the tracker reads
+        # before anything is drawn over it
+        frame, hand = process_frame(frame, tracker, timings, out=canvas.frame_resized)
+        if not present(canvas, frame, hand, timings, output):
+            break
+
+
+def run_threaded(cap, tracker, canvas, timings, output, lossless=False):
+    """Capture, inference and rendering run concurrently on their own threads.
+
+    Each stage hands its output to the next through a LatestSlot, so a slow
+    stage skips stale frames instead of queueing them up, unless
+    ``lossless`` is set.
+    """
+    captured = LatestSlot(lossless)
+    tracked = LatestSlot(lossless)
+    stop = threading.Event()
+
+    def capture():
+        while not stop.is_set():
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                break
+            timings.add("capture", time.perf_counter() - start)
+            captured.put(frame)
+        captured.put(None)
+
+    def inference():
+        while not stop.is_set():
+            frame = captured.get()
+            if frame is None:
+                break
+            # A buffer of its own per frame: the render thread may still be
+            # drawing over the last one
+            tracked.put(process_frame(frame, tracker, timings))
+        tracked.put(None)
+
+    workers = [threading.Thread(target=capture, daemon=True),
+               threading.Thread(target=inference, daemon=True)]
+    for worker in workers:
+        worker.start()
+
+    # The render loop stays on the main thread, which HighGUI requires
+    while True:
+        item = tracked.get()
+        if item is None:
+            break
+        frame, hand = item
+        if not present(canvas, frame, hand, timings, output):
+            break
+
+    stop.set()
+    for worker in workers:
+        worker.join(timeout=1)
+    print(f"Dropped frames: capture {captured.dropped}, inference {tracked.dropped}")
+
+
+def make_tracker(args, hands=None):
+    """The tracker the command line asks for, on a new MediaPipe Hands unless one is given"""
+    if args.synthetic:
+        return SyntheticTracker(seed=args.seed, hands=args.hands)
+    if hands is None:
+        hands = load_mediapipe().Hands(max_num_hands=args.hands, min_detection_confidence=0.7)
+    # Predicting skipped frames extrapolates from the filtered landmarks
+    smoothing = args.smooth or args.track_every > 1
+    return HandTracker(hands, every=max(1, args.track_every), adaptive=args.adaptive_tracking,
+                       smoothing=smoothing, scale=args.inference_scale, roi=args.roi,
+                       max_hands=args.hands)
+
+
+# Batch mode: each worker process keeps one MediaPipe Hands instance and
+# reuses it for every file it is given
+batch_hands = None
+
+
+def init_batch_worker(args):
+    global batch_hands
+    cv2.setNumThreads(1)  # The pool already uses every core
+    if not args.synthetic:
+        batch_hands = load_mediapipe().Hands(max_num_hands=args.hands, min_detection_confidence=0.7)
+
+
+def batch_outputs(paths, output_dir):
+    """A canvas file of its own for each --batch video: the video's path
+    below the videos' common directory, numbered if that is taken"""
+    names = [os.path.splitext(os.path.abspath(path))[0] for path in paths]
+    root = os.path.commonpath([os.path.dirname(name) for name in names])
+    outputs = []
+    for name in names:
+        name = os.path.join(output_dir, os.path.relpath(name, root))
+        output, number = name + '.png', 1
+        while output in outputs:
+            number += 1
+            output = f"{name}-{number}.png"
+        outputs.append(output)
+    return outputs
+
+
+def draw_video(path, output, args):
+    """Run the drawing logic over one video file in a batch worker and write
+    the finished canvas to ``output``; returns the file's throughput stats"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise Exception(f"Cannot open {path}")
+    if batch_hands is not None and hasattr(batch_hands, 'reset'):
+        batch_hands.reset()  # Tracking state from the previous file does not carry over
+    tracker = make_tracker(args, batch_hands)
+    canvas = AirCanvas(hands=args.hands, spline=args.spline, undo_levels=args.undo_levels,
+                       infinite=args.infinite)
+    timings = StageTimes(window=None)
+    frames = 0
+    start = time.perf_counter()
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame, hand = process_frame(frame, tracker, timings, out=canvas.frame_resized)
+        if hand is not None:
+            canvas.handle_hands(hand[0])
+        # Nobody watches the webcam view, so only the canvas is brought up to date
+        canvas.settle()
+        frames += 1
+    cap.release()
+    for hand in range(len(canvas.pens)):
+        canvas.end_stroke(hand)
+    canvas.draw_pending()
+    canvas.settle()
+    if canvas.world is not None:
+        canvas.refresh_view()
+    elapsed = time.perf_counter() - start
+
+    image = canvas.paintWindow.copy()
+    image[:TOOLBAR_HEIGHT] = 255
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    cv2.imwrite(output, image)
+    stages = timings.summary()
+    return {'file': path, 'canvas': output, 'frames': frames, 'seconds': elapsed,
+            'fps': frames / elapsed if elapsed > 0 else 0.0,
+            'tracking_ms': stages.get('inference', stages.get('track', {})).get('mean', 0.0),
+            'strokes': sum(len(pen.strokes) for pen in canvas.pens)}
+
+
+def run_batch(args):
+    """Draw every --batch video on a process pool and write per-file stats"""
+    os.makedirs(args.output_dir, exist_ok=True)
+    workers = args.workers or os.cpu_count()
+    outputs = batch_outputs(args.batch, args.output_dir)
+    results = [None] * len(args.batch)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker,
+                             initargs=(args,)) as pool:
+        futures = {pool.submit(draw_video, path, output, args): i
+                   for i, (path, output) in enumerate(zip(args.batch, outputs))}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"{args.batch[futures[future]]}: {e}")
+                continue
+            results[futures[future]] = result
+            print(f"{result['file']}: {result['frames']} frames in {result['seconds']:.1f} s "
+                  f"({result['fps']:.1f} FPS) -> {result['canvas']}")
+    elapsed = time.perf_counter() - start
+    stats = [result for result in results if result is not None]
+    frames = sum(result['frames'] for result in stats)
+    print(f"{len(stats)}/{len(args.batch)} files, {frames} frames in {elapsed:.1f} s "
+          f"({frames / elapsed:.1f} FPS on {workers} workers)")
+
+    with open(os.path.join(args.output_dir, 'batch_stats.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, ['file', 'canvas', 'frames', 'seconds', 'fps', 'tracking_ms', 'strokes'])
+        writer.writeheader()
+        writer.writerows({key: round(value, 3) if isinstance(value, float) else value
+                          for key, value in result.items()} for result in stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Draw in the air with your index finger")
+    parser.add_argument('--threaded', action='store_true',
+                        help="run capture, hand tracking and rendering on separate threads")
+    parser.add_argument('--track-every', type=int, default=1, metavar='N',
+                        help="run hand tracking on every Nth frame and predict the hand in between")
+    parser.add_argument('--adaptive-tracking', action='store_true',
+                        help="pick N (up to --track-every) from the measured inference latency")
+    parser.add_argument('--smooth', action='store_true',
+                        help="smooth fingertip positions with a One-Euro filter")
+    parser.add_argument('--inference-scale', type=float, default=1.0, metavar='S',
+                        help="downscale frames by S before hand tracking")
+    parser.add_argument('--roi', action='store_true',
+                        help="track the hand on a crop around its last known position")
+    parser.add_argument('--record', metavar='PATH',
+                        help="record the drawing session to a session file")
+    parser.add_argument('--replay', metavar='PATH',
+                        help="re-render a recorded session without a camera or window")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="resolution scale for --replay output")
+    parser.add_argument('--output', metavar='PNG',
+                        help="where --replay writes the rendered canvas")
+    parser.add_argument('--svg', metavar='PATH',
+                        help="export the strokes as SVG on exit (or after --replay); "
+                             "with --infinite it is sized to the drawing")
+    parser.add_argument('--input', metavar='PATH',
+                        help="read a video file, image directory or image glob instead of the webcam")
+    parser.add_argument('--synthetic', action='store_true',
+                        help="drive the canvas with scripted landmarks instead of MediaPipe")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="random seed for the --synthetic script")
+    parser.add_argument('--frames', type=int, default=600, metavar='N',
+                        help="frames to generate for --synthetic without --input")
+    parser.add_argument('--headless', action='store_true',
+                        help="do not open a window; frames are discarded unless --write-video is given")
+    parser.add_argument('--write-video', metavar='PATH',
+                        help="write the window frames to a video file")
+    parser.add_argument('--hands', type=int, default=1, metavar='N',
+                        help="track up to N hands, each drawing with its own tools")
+    parser.add_argument('--spline', action='store_true',
+                        help="draw strokes as smooth curves through the fingertip samples")
+    parser.add_argument('--undo-levels', type=int, default=256, metavar='N',
+                        help="how many steps 'z' can undo ('y' redoes)")
+    parser.add_argument('--infinite', action='store_true',
+                        help="draw on an unbounded canvas; two fingers up pan and zoom, as do +, - and 0")
+    parser.add_argument('--hud', action='store_true',
+                        help="show FPS and per-stage timings over the webcam view")
+    parser.add_argument('--metrics', metavar='PATH',
+                        help="write per-stage timing statistics on exit, as CSV (.csv) or JSON")
+    parser.add_argument('--batch', nargs='+', metavar='VIDEO',
+                        help="draw each video file on a process pool and write its canvas, then exit")
+    parser.add_argument('--output-dir', default='canvases', metavar='DIR',
+                        help="where --batch writes batch_stats.csv and the canvases, in the videos' folder layout")
+    parser.add_argument('--workers', type=int, default=0, metavar='N',
+                        help="worker processes for --batch (default: one per core)")
+    parser.add_argument('--serve', metavar='[HOST:]PORT',
+                        help="relay a shared canvas to other participants, and draw on it; "
+                             "'z' and 'y' are off while sharing")
+    parser.add_argument('--join', metavar='[HOST:]PORT',
+                        help="draw on the shared canvas of a --serve instance; "
+                             "'z' and 'y' are off while sharing")
+    args = parser.parse_args()
+    if not 1 <= args.hands <= 16:
+        parser.error("--hands must be between 1 and 16")  # Session files store the hand in 4 bits
+
+    if args.replay:
+        replay(args)
+        return
+
+    if args.batch:
+        run_batch(args)
+        return
+
+    tracker = make_tracker(args)
+    cap = open_source(args)
+    # Offline runs are benchmarks, so keep every sample for the percentiles
+    live = args.input is None and not args.synthetic
+    timings = StageTimes() if live else StageTimes(window=None)
+    # Offline inputs are rendered as fast as possible, so their videos wait
+    # for the encoder rather than drop frames
+    output = FrameOutput(window=not args.headless, video=args.write_video,
+                         hud=PerformanceHud(timings) if args.hud else None, lossless=not live)
+
+    canvas = AirCanvas(hands=args.hands, spline=args.spline, undo_levels=args.undo_levels,
+                       infinite=args.infinite)
+    if args.record:
+        canvas.recorders.append(SessionRecorder(args.record, canvas_width, canvas_height))
+    if args.serve:
+        host, port = parse_address(args.serve, default_host='0.0.0.0')
+        start_relay(host, port)
+        canvas.link = CanvasLink('127.0.0.1' if host == '0.0.0.0' else host, port)
+    elif args.join:
+        canvas.link = CanvasLink(*parse_address(args.join))
+    if canvas.link is not None:
+        canvas.recorders.append(canvas.link)
+    if args.hud or args.metrics:
+        # Time the drawing stages too; otherwise their instrumentation does nothing
+        canvas.timings = timings
+    started = time.perf_counter()
+    if args.threaded:
+        run_threaded(cap, tracker, canvas, timings, output, lossless=not live)
+    else:
+        run_sequential(cap, tracker, canvas, timings, output)
+
+    cap.release()
+    output.close()
+    elapsed = time.perf_counter() - started
+    timings.report(elapsed)
+    if args.metrics:
+        timings.export(args.metrics, elapsed)
+    for recorder in canvas.recorders:
+        recorder.close()
+    if canvas.link is not None:
+        print(f"Sent {canvas.link.sent} bytes of drawing")
+    if args.svg:
+        export_svg(canvas, args.svg, canvas_width, canvas_height, fit=args.infinite)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,138 @@
-from parser import FunctionDecl, If, While, Compound, Printf
+import re
+from parser import FunctionDecl, If, While, Compound, Printf, Num, Var, UnaryOp
+
+# C integer division truncates toward zero; Python's // floors.  Used when an
+# operand is too complex to repeat inline.
+C_DIV_HELPER = '''def _c_div(a, b):
+    q = a // b
+    return q + 1 if q < 0 and q * b != a else q
+'''
+
+# C's integer precision (a minimum number of digits) and its '#' forms (a
+# leading 0 for %#o, no 0x for a zero %#x), which str.format() lacks;
+# returns the converted value padded to width
+C_INT_HELPER = '''def _c_int(value, conversion, flags, width, precision, alternate):
+    digits = format(abs(value), conversion)
+    if precision is not None:
+        digits = digits.zfill(precision) if precision or value else ''
+    prefix = '-' if value < 0 else '+' if '+' in flags else ' ' if ' ' in flags else ''
+    if alternate and conversion == 'o' and not digits.startswith('0'):
+        digits = '0' + digits
+    elif alternate and conversion in 'xX' and value:
+        prefix += '0' + conversion
+    if '-' in flags:
+        return (prefix + digits).ljust(width)
+    if '0' in flags and precision is None:
+        return prefix + digits.zfill(width - len(prefix))
+    return (prefix + digits).rjust(width)
+'''
+
+# printf output is collected into a list and written in batches instead of
+# one print() call per printf
+OUTPUT_HELPER = '''_out = []
+
+def _flush():
+    text = ''.join(_out)
+    _out.clear()
+    sys.stdout.write(text)
+'''
+
+# scanf reads piped input with a single bulk read and splits it lazily;
+# interactive input is read a line at a time after flushing any prompt
+INPUT_HELPER = '''def _input_tokens():
+    stdin = sys.stdin
+    if stdin.isatty():
+        while True:
+            _flush()
+            sys.stdout.flush()
+            line = stdin.readline()
+            if not line:
+                break
+            yield from line.split()
+    else:
+        data = stdin.buffer.read() if hasattr(stdin, 'buffer') else stdin.read().encode()
+        for match in re.finditer(rb'\\S+', data):
+            yield match.group()
+    raise EOFError('scanf: no more input')
+
+_next_token = _input_tokens().__next__
+'''
+
+# Flush buffered output from loops once this many pieces are pending
+OUTPUT_BATCH = 1024
+
+# %[flags][width][.precision][length]conversion
+PRINTF_SPEC = re.compile(r'%([-+ #0]*)(\d*)(?:\.(\d+))?(?:hh|h|ll|l|L)?([diufFeEgGxXoscp%])')
+
+def printf_plan(format_str):
+    """Split a printf format into literal text and conversion specs.
+
+    Returns a list whose items are either literal strings or
+    (flags, width, precision, conversion) tuples, or None when the format
+    uses something the plan cannot express.
+    """
+    plan = []
+    pos = 0
+    for match in PRINTF_SPEC.finditer(format_str):
+        literal = format_str[pos:match.start()]
+        if '%' in literal:
+            return None
+        if literal:
+            plan.append(literal)
+        flags, width, precision, conversion = match.groups()
+        if conversion == '%':
+            plan.append('%')
+        elif conversion == 'p':
+            return None
+        else:
+            plan.append((flags, width, precision, conversion))
+        pos = match.end()
+    if '%' in format_str[pos:]:
+        return None
+    if pos < len(format_str):
+        plan.append(format_str[pos:])
+    return plan
+
+def format_spec(flags, width, precision, conversion):
+    """Translate a printf conversion into a str.format() spec"""
+    spec = ''
+    if '-' in flags:
+        spec += '<'
+    elif conversion in 'sc' and width:
+        spec += '>'  # C right-aligns strings, Python left-aligns them
+    if '+' in flags:
+        spec += '+'
+    elif ' ' in flags:
+        spec += ' '
+    if '#' in flags:
+        spec += '#'
+    if '0' in flags and '-' not in flags and conversion not in 'sc':
+        spec += '0'
+    spec += width
+    if precision is not None and conversion not in 'diuxXo':
+        spec += '.' + precision
+    spec += {'i': 'd', 'u': 'd', 's': '', 'c': ''}.get(conversion, conversion)
+    return spec
+
+def escape_literal(text, f_string=False):
+    """Escape text for a double-quoted Python string literal"""
+    text = (text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            .replace('\t', '\\t').replace('\r', '\\r'))
+    if f_string:
+        text = text.replace('{', '{{').replace('}', '}}')
+    return text
 
 class CodeGenerator:
     def __init__(self):
         self.indent_level = 0
         self.code = []
+        self.helpers = set()
+        self.printf_count = 0
+
+    @property
+    def reads_input(self):
+        """Whether the generated code reads stdin, i.e. uses scanf"""
+        return INPUT_HELPER in self.helpers
 
     def indent(self):
         self.indent_level += 1
@@ -22,9 +151,26 @@ class CodeGenerator:
     def generic_visit(self, node):
         raise Exception(f'No visit_{type(node).__name__} method')
 
+    def is_simple(self, node):
+        """True for operands that are cheap and side-effect free to repeat"""
+        if isinstance(node, UnaryOp):
+            return self.is_simple(node.expr)
+        return isinstance(node, (Num, Var))
+
+    def operand(self, node, operand_type):
+        # An int literal in a float operation is emitted as a float literal,
+        # so CPython can keep both operands float and use its specialised
+        # float arithmetic instead of the mixed-type slow path
+        if operand_type == 'float' and isinstance(node, Num) and node.token.type == 'INTEGER_CONST':
+            return repr(float(node.value))
+        return self.visit(node)
+
     def visit_BinOp(self, node):
-        left = self.visit(node.left)
-        right = self.visit(node.right)
+        operand_type = getattr(node, 'operand_type', None)
+        left = self.operand(node.left, operand_type)
+        right = self.operand(node.right, operand_type)
+        if node.op.type == 'DIVIDE' and operand_type == 'int':
+            return self.int_division(node, left, right)
         op_map = {
             'PLUS': '+',
             'MINUS': '-',
@@ -40,6 +186,16 @@ class CodeGenerator:
         op = op_map[node.op.type]
         return f'({left} {op} {right})'
 
+    def int_division(self, node, left, right):
+        if isinstance(node.right, Num) and node.right.value > 0:
+            # Constant positive divisor: only the dividend's sign matters
+            if self.is_simple(node.left):
+                return f'({left} // {right} if {left} >= 0 else -(-{left} // {right}))'
+        elif self.is_simple(node.left) and self.is_simple(node.right):
+            return f'({left} // {right} if ({left} >= 0) == ({right} >= 0) else -(-{left} // {right}))'
+        self.helpers.add(C_DIV_HELPER)
+        return f'_c_div({left}, {right})'
+
     def visit_UnaryOp(self, node):
         op = '+' if node.op.type == 'PLUS' else '-'
         expr = self.visit(node.expr)
@@ -53,7 +209,14 @@ class CodeGenerator:
 
     def visit_Assign(self, node):
         var_name = self.visit(node.left)
-        expr = self.visit(node.right)
+        var_type = getattr(node, 'ctype', None)
+        expr_type = getattr(node.right, 'ctype', None)
+        expr = self.operand(node.right, var_type)
+        # Keep each variable's runtime type equal to its declared type
+        if var_type == 'int' and expr_type == 'float':
+            expr = f'int({expr})'
+        elif var_type == 'float' and expr_type == 'int' and not isinstance(node.right, Num):
+            expr = f'float({expr})'
         self.write(f'{var_name} = {expr}')
 
     def visit_Compound(self, node):
@@ -77,28 +240,93 @@ class CodeGenerator:
         condition = self.visit(node.condition)
         self.write(f'while {condition}:')
         self.indent()
+        printf_count = self.printf_count
         self.visit(node.body)
+        if self.printf_count != printf_count:
+            # Keep memory bounded for loops that print every iteration
+            self.write(f'if len(_out) > {OUTPUT_BATCH}:')
+            self.indent()
+            self.write('_flush()')
+            self.dedent()
         self.dedent()
 
     def visit_VarDecl(self, node):
         var_name = node.var_node.value
-        # In Python we don't need explicit type declarations
-        self.write(f'{var_name} = None')
+        # Pre-initialise to a value of the declared type
+        initial = {'int': '0', 'float': '0.0'}.get(getattr(node, 'ctype', None), 'None')
+        self.write(f'{var_name} = {initial}')
 
     def visit_Printf(self, node):
-        # Replace newlines with explicit \n
-        format_str = node.format_str.replace('\n', '\\n')
+        self.printf_count += 1
+        self.helpers.add(OUTPUT_HELPER)
         args = [self.visit(arg) for arg in node.args]
-        args_str = ', '.join(args)
-        if args:
-            self.write(f'print("{format_str}" % ({args_str}))')
-        else:
-            self.write(f'print("{format_str}")')
+        plan = printf_plan(node.format_str)
+        if plan is None:
+            # Fall back to runtime % formatting
+            format_str = escape_literal(node.format_str)
+            args_str = ''.join(f'{arg}, ' for arg in args)
+            self.write(f'_emit("{format_str}" % ({args_str}))')
+            return
+        if not args:
+            self.write(f'_emit("{escape_literal("".join(plan))}")')
+            return
+
+        # Lower the format at compile time into an f-string
+        pieces = []
+        arguments = iter(zip(node.args, args))
+        for item in plan:
+            if isinstance(item, str):
+                pieces.append(escape_literal(item, f_string=True))
+                continue
+            flags, width, precision, conversion = item
+            arg_node, value = next(arguments)
+            if conversion in 'diuxXoc' and getattr(arg_node, 'ctype', None) != 'int':
+                value = f'int({value})'
+            if conversion == 'c':
+                value = f'chr({value})'
+            if conversion in 'uxXo':
+                flags = flags.replace('+', '').replace(' ', '')  # Signs are for signed conversions only
+            if conversion in 'diuxXo' and (precision is not None or '#' in flags and conversion in 'oxX'):
+                self.helpers.add(C_INT_HELPER)
+                conversion = 'd' if conversion in 'iu' else conversion
+                precision = int(precision) if precision is not None else None
+                # '#' is not allowed inside an f-string field, so it is passed on its own
+                call = (f"{value}, {conversion!r}, {flags.replace('#', '')!r}, {int(width or 0)}, "
+                        f"{precision}, {'#' in flags}")
+                pieces.append(f'{{_c_int({call})}}')
+                continue
+            spec = format_spec(flags, width, precision, conversion)
+            if spec == 'd':
+                spec = ''  # str() of an int is the same and cheaper
+            pieces.append(f'{{{value}:{spec}}}' if spec else f'{{{value}}}')
+        self.write(f'_emit(f"{"".join(pieces)}")')
+
+    def visit_Scanf(self, node):
+        self.helpers.add(INPUT_HELPER)
+        self.helpers.add(OUTPUT_HELPER)
+        for target in node.targets:
+            # int() and float() accept the raw bytes tokens directly
+            convert = 'float' if getattr(target, 'ctype', None) == 'float' else 'int'
+            self.write(f'{self.visit(target)} = {convert}(_next_token())')
 
     def visit_FunctionDecl(self, node):
         self.write(f'def {node.name}():')
         self.indent()
+        start = len(self.code)
+        printf_count = self.printf_count
         self.visit(node.body)
+        if self.printf_count != printf_count:
+            # Bind the buffer's append locally and flush whatever is left
+            # when the function returns or fails
+            body = ['    ' + line if line else line for line in self.code[start:]]
+            self.code[start:] = []
+            self.write('_emit = _out.append')
+            self.write('try:')
+            self.code.extend(body)
+            self.write('finally:')
+            self.indent()
+            self.write('_flush()')
+            self.dedent()
         self.dedent()
 
     def generate_code(self, node):
@@ -110,6 +338,13 @@ class CodeGenerator:
         # Visit the AST
         self.visit(node)
         
+        # Runtime helpers the generated code refers to go before the body
+        if self.helpers:
+            helpers = [line for helper in sorted(self.helpers) for line in helper.splitlines() + ['']]
+            self.code[3:3] = helpers
+            if INPUT_HELPER in self.helpers:
+                self.code.insert(2, 'import re')
+        
         # Add main function call
         if isinstance(node, FunctionDecl) and node.name == 'main':
             self.write('')
@@ -1,7 +1,10 @@
+import time
+_STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog, simpledialog
 import sys
-from main import compile_c
+import argparse
 import tempfile
 import os
 from tkinter.font import Font
@@ -22,6 +25,34 @@ THEME = {
     'highlight': '#E8F2FF'      # Light blue highlight
 }
 
+class StartupTimer:
+    """Records wall-clock marks for the GUI startup phases.
+
+    The report mirrors the layout of ``python -X importtime`` so both can be
+    read side by side: self time and cumulative time in microseconds.
+    """
+    def __init__(self, enabled=False, start=None):
+        self.enabled = enabled
+        self.start = start if start is not None else time.perf_counter()
+        self.last = self.start
+        self.marks = []
+
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.marks.append((phase, now - self.last, now - self.start))
+        self.last = now
+
+    def report(self, stream=None):
+        if not self.enabled:
+            return
+        stream = stream or sys.stderr
+        print("startup: self [us] | cumulative | phase", file=stream)
+        for phase, self_time, cumulative in self.marks:
+            print(f"startup: {int(self_time * 1e6):>9} | {int(cumulative * 1e6):>10} | {phase}",
+                  file=stream)
+
 class GradientFrame(tk.Canvas):
     def __init__(self, parent, color1="#E6F3FF", color2="#FFE6F0", **kwargs):
         tk.Canvas.__init__(self, parent, **kwargs)
@@ -144,7 +175,7 @@ class LineNumberedText(tk.Frame):
 
         # Define syntax patterns
         patterns = {
-            'keywords': r'\b(void|int|float|if|else|while|for|return|printf)\b',
+            'keywords': r'\b(void|int|float|if|else|while|for|return|printf|scanf)\b',
             'strings': r'"[^"]*"',
             'comments': r'//.*$',
             'numbers': r'\b\d+(\.\d+)?\b',
@@ -180,8 +211,11 @@ class LineNumberedText(tk.Frame):
         self.text.tag_remove('error_highlight', '1.0', tk.END)
 
 class CompilerGUI:
-    def __init__(self, root):
+    def __init__(self, root, lazy=False, timer=None):
         self.root = root
+        self.lazy = lazy
+        self.timer = timer or StartupTimer()
+        self._panels_built = False
         self.root.title("Compiler")
         
         # Configure root window
@@ -191,12 +225,17 @@ class CompilerGUI:
         
         # Configure modern styles
         self.configure_styles()
+        self.timer.mark("styles")
         
-        # Create menu bar
-        self.create_menu_bar()
+        # Create menu bar (deferred until the window is up in lazy mode)
+        if lazy:
+            self.root.after_idle(self._build_menu_bar)
+        else:
+            self._build_menu_bar()
         
         # Create toolbar
         self.create_toolbar()
+        self.timer.mark("toolbar")
         
         # Create main container
         self.main_container = ttk.PanedWindow(root, orient=tk.HORIZONTAL, style='Modern.TPanedwindow')
@@ -210,20 +249,38 @@ class CompilerGUI:
         self.right_frame = ttk.Frame(self.main_container, style='Modern.TFrame')
         self.main_container.add(self.right_frame, weight=1)
         
-        # Create error panel
-        self.create_error_panel()
-        
         # Create status bar
         self.create_status_bar()
         
         # Add components to left panel
         self.create_left_panel()
+        self.timer.mark("editor panel")
         
-        # Add components to right panel
-        self.create_right_panel()
+        # Error and output panels are only needed once the user compiles,
+        # so lazy mode builds them on first use
+        if not lazy:
+            self.ensure_panels()
         
         # Initialize with sample code
         self.load_sample_code()
+        self.timer.mark("sample code")
+
+    def _build_menu_bar(self):
+        self.create_menu_bar()
+        self.timer.mark("menu bar")
+
+    def ensure_panels(self):
+        """Build the error panel and the right-hand panels if not done yet"""
+        if self._panels_built:
+            return
+        self._panels_built = True
+        
+        # Create error panel
+        self.create_error_panel()
+        
+        # Add components to right panel
+        self.create_right_panel()
+        self.timer.mark("secondary panels")
 
     def configure_styles(self):
         style = ttk.Style()
@@ -330,7 +387,7 @@ class CompilerGUI:
     def create_error_panel(self):
         self.error_frame = ttk.LabelFrame(self.root, text="Compiler Messages", 
                                         style='Modern.TLabelframe')
-        self.error_frame.pack(fill=tk.X, padx=10, pady=(5, 0))
+        self.error_frame.pack(fill=tk.X, padx=10, pady=(5, 0), before=self.status_bar)
         
         self.error_display = tk.Text(self.error_frame, height=3, wrap=tk.WORD,
                                    background=THEME['bg_secondary'],
@@ -397,6 +454,7 @@ class CompilerGUI:
         run_menu.add_command(label="Run", command=self.run_code)
 
     def new_file(self):
+        self.ensure_panels()
         if messagebox.askyesno("New File", "Do you want to clear the current code?"):
             self.c_code_editor.text.delete('1.0', tk.END)
             self.python_code_display.text.config(state='normal')
@@ -469,6 +527,7 @@ class CompilerGUI:
         self.status_bar.config(text="Loaded sample code")
 
     def show_error(self, error_msg, line_number=None, start_col=None, end_col=None, level='error'):
+        self.ensure_panels()
         # Update error display with modern styling
         self.error_display.config(state='normal')
         self.error_display.delete('1.0', tk.END)
@@ -489,6 +548,7 @@ class CompilerGUI:
         self.status_bar.config(text=f"❌ Error: {error_msg}")
 
     def show_success(self, message):
+        self.ensure_panels()
         self.error_display.config(state='normal')
         self.error_display.delete('1.0', tk.END)
         self.error_display.insert('1.0', f"✓ {message}", 'success')
@@ -496,6 +556,7 @@ class CompilerGUI:
         self.status_bar.config(text=f"✓ {message}")
 
     def compile_code(self):
+        self.ensure_panels()
         try:
             self.clear_error()
             self.status_bar.config(text="Compiling...")
@@ -504,8 +565,9 @@ class CompilerGUI:
             c_code = self.c_code_editor.text.get('1.0', tk.END)
             
             try:
-                # Compile the code
-                python_code = compile_c(c_code)
+                # Compile the code (the compiler modules load on first use)
+                from main import compile_program
+                python_code, self.current_reads_input = compile_program(c_code)
                 
                 # Display the generated Python code
                 self.python_code_display.text.config(state='normal')
@@ -545,9 +607,26 @@ class CompilerGUI:
             self.show_error(str(e))
 
     def run_code(self):
+        self.ensure_panels()
         if not hasattr(self, 'current_py_file'):
             self.show_error("Please compile the code first!")
             return
+
+        try:
+            with open(self.current_py_file, 'r') as file:
+                code = file.read()
+        except OSError:
+            self.show_error("Please compile the code first!")
+            return
+        program_input = ''
+        if self.current_reads_input:
+            # scanf would read the GUI's own stdin and block the window, so
+            # the program's input is asked for before it runs
+            program_input = simpledialog.askstring(
+                "Program Input", "Input for scanf, separated by spaces:", parent=self.root)
+            if program_input is None:
+                self.status_bar.config(text="Run cancelled")
+                return
         
         try:
             self.clear_error()
@@ -558,11 +637,14 @@ class CompilerGUI:
             from contextlib import redirect_stdout
             
             f = io.StringIO()
+            stdin = sys.stdin
+            sys.stdin = io.StringIO(program_input)
             with redirect_stdout(f):
                 try:
                     # Execute the Python code
-                    with open(self.current_py_file, 'r') as file:
-                        exec(file.read())
+                    # Run in a fresh namespace so the generated module-level
+                    # helpers are visible to its functions
+                    exec(code, {'__name__': '__main__'})
                 except Exception as e:
                     error_msg = str(e)
                     line_number = None
@@ -575,6 +657,8 @@ class CompilerGUI:
                     
                     self.show_error(f"Runtime Error: {error_msg}", line_number)
                     return
+                finally:
+                    sys.stdin = stdin
             
             # Get the output and display it
             output = f.getvalue()
@@ -596,6 +680,7 @@ class CompilerGUI:
                     pass
 
     def clear_error(self):
+        self.ensure_panels()
         # Clear error display
         self.error_display.config(state='normal')
         self.error_display.delete('1.0', tk.END)
@@ -608,8 +693,25 @@ class CompilerGUI:
         self.status_bar.config(text="Ready")
 
 def main():
+    arg_parser = argparse.ArgumentParser(description="C to Python compiler GUI")
+    arg_parser.add_argument('--lazy', action='store_true',
+                            help="show the window first and build secondary panels on first use")
+    arg_parser.add_argument('--startup-report', action='store_true',
+                            help="print per-phase startup timings to stderr")
+    args = arg_parser.parse_args()
+
+    timer = StartupTimer(enabled=args.startup_report, start=_STARTUP_T0)
+    timer.mark("imports")
     root = tk.Tk()
-    app = CompilerGUI(root)
+    timer.mark("tk root")
+    app = CompilerGUI(root, lazy=args.lazy, timer=timer)
+    if args.startup_report:
+        # The window is on screen once the first idle pass has run
+        def first_paint():
+            root.update_idletasks()
+            timer.mark("first paint")
+            timer.report()
+        root.after_idle(first_paint)
     root.mainloop()
 
 if __name__ == "__main__":
@@ -176,6 +176,7 @@ class Lexer:
                 if self.current_char == '&':
                     self.advance()
                     return Token('AND', '&&')
+                return Token('AMPERSAND', '&')
             if self.current_char == '|':
                 self.advance()
                 if self.current_char == '|':
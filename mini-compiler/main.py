@@ -1,9 +1,15 @@
 import sys
 from lexer import Lexer
 from parser import Parser
+from type_checker import TypeChecker
 from code_generator import CodeGenerator
 
 def compile_c(source_code):
+    return compile_program(source_code)[0]
+
+def compile_program(source_code):
+    """Compile C code; returns (python_code, reads_input), reads_input
+    telling whether the program reads its stdin through scanf"""
     # Create lexer
     lexer = Lexer(source_code)
     
@@ -13,13 +19,16 @@ def compile_c(source_code):
     # Parse the source code to create AST
     ast = parser.parse()
     
+    # Resolve declared types so the generator can emit typed code
+    TypeChecker().check(ast)
+    
     # Create code generator
     generator = CodeGenerator()
     
     # Generate Python code from AST
     python_code = generator.generate_code(ast)
     
-    return python_code
+    return python_code, generator.reads_input
 
 def main():
     if len(sys.argv) != 2:
@@ -68,6 +68,11 @@ class Printf(AST):
         self.format_str = format_str
         self.args = args
 
+class Scanf(AST):
+    def __init__(self, format_str, targets):
+        self.format_str = format_str
+        self.targets = targets
+
 class Parser:
     def __init__(self, lexer):
         self.lexer = lexer
@@ -151,6 +156,7 @@ class Parser:
                     | while_statement
                     | declaration_statement
                     | printf_statement
+                    | scanf_statement
                     | empty
         """
         if self.current_token.type == 'LBRACE':
@@ -165,6 +171,8 @@ class Parser:
             node = self.while_statement()
         elif self.current_token.type == 'PRINTF':
             node = self.printf_statement()
+        elif self.current_token.type == 'SCANF':
+            node = self.scanf_statement()
         else:
             node = self.empty()
         return node
@@ -313,6 +321,22 @@ class Parser:
         self.eat('RPAREN')
         return Printf(format_str, args)
 
+    def scanf_statement(self):
+        """scanf_statement : SCANF LPAREN STRING_CONST (COMMA AMPERSAND variable)* RPAREN"""
+        self.eat('SCANF')
+        self.eat('LPAREN')
+        format_str = self.current_token.value
+        self.eat('STRING_CONST')
+        
+        targets = []
+        while self.current_token.type == 'COMMA':
+            self.eat('COMMA')
+            self.eat('AMPERSAND')
+            targets.append(self.variable())
+        
+        self.eat('RPAREN')
+        return Scanf(format_str, targets)
+
     
     def parse(self):
         node = self.program()
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import unittest
+from main import compile_c
+
+def run_c(source_code):
+    """Compile C source and run it; returns what it printed"""
+    with contextlib.redirect_stdout(io.StringIO()):  # The parser traces every token
+        python_code = compile_c(source_code)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        exec(python_code, {'__name__': '__main__'})
+    return output.getvalue()
+
+# (format, arguments, what C's printf writes), the output as gcc/glibc gives it
+PRINTF_CASES = [
+    ('[%.3d][%5.3d][%-6.3d][%08.3d][%.0d]', '5, 5, 5, 5, 0', '[005][  005][005   ][     005][]'),
+    ('[%+.3d][% .3d][%.3d][%05d]', '5, 5, -5, -5', '[+005][ 005][-005][-0005]'),
+    ('[%+d][%-5d|][% d][%d]', '5, -5, 5, 42', '[+5][-5   |][ 5][42]'),
+    ('[%#o][%#o][%#5o][%#.3o][%o]', '5, 0, 8, 8, 8', '[05][0][  010][010][10]'),
+    ('[%#x][%#x][%#X][%#08x][%#.4x]', '255, 0, 255, 255, 255', '[0xff][0][0XFF][0x0000ff][0x00ff]'),
+    ('[%x][%X][%+u][% u][%5u][%.4u]', '255, 255, 7, 7, 7, 7', '[ff][FF][7][7][    7][0007]'),
+    ('[%f][%.2f][%8.3f][%-8.1f|][%+.1f]', '3.14159, 3.14159, 3.14159, 3.14159, 2.5',
+     '[3.141590][3.14][   3.142][3.1     |][+2.5]'),
+    ('[%e][%.2E][%g][%G]', '1234.5, 0.000123, 0.0001, 100000000000000000000.0',
+     '[1.234500e+03][1.23E-04][0.0001][1E+20]'),
+    ('[%c][%3c][%-3c|][%%]', '65, 66, 67', '[A][  B][C  |][%]'),
+]
+
+class PrintfTest(unittest.TestCase):
+    def test_conversions_match_c(self):
+        for format_str, args, expected in PRINTF_CASES:
+            with self.subTest(format=format_str):
+                source = f'void main() {{\n    printf("{format_str}\\n", {args});\n}}\n'
+                self.assertEqual(run_c(source), expected + '\n')
+
+    def test_variables_and_literal_text(self):
+        source = ('void main() {\n    int n;\n    float x;\n    n = 7;\n    x = 1.5;\n'
+                  '    printf("n=%d x=%.1f {braces} \\"quoted\\"\\n", n, x);\n}\n')
+        self.assertEqual(run_c(source), 'n=7 x=1.5 {braces} "quoted"\n')
+
+class DivisionTest(unittest.TestCase):
+    def test_int_division_truncates_toward_zero(self):
+        # Variables take the inline path; sums need the _c_div helper
+        source = ('void main() {\n    int a;\n    int b;\n'
+                  + ''.join(f'    a = {a};\n    b = {b};\n'
+                            '    printf("%d %d %d\\n", a / b, (a + 0) / (b + 0), (a + 0) / 2);\n'
+                            for a, b in ((7, 2), (-7, 2), (7, -2), (-7, -2), (-6, 3), (0, -5)))
+                  + '}\n')
+        self.assertEqual(run_c(source), '3 3 3\n-3 -3 -3\n-3 -3 3\n3 3 -3\n-2 -2 -3\n0 0 0\n')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIn('def _c_div(', compile_c(source))
+
+if __name__ == '__main__':
+    unittest.main()
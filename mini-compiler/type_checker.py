@@ -0,0 +1,137 @@
+import re
+
+# %[width][length]conversion, for the numeric conversions scanf supports
+SCANF_SPEC = re.compile(r'%(\d*)(?:hh|h|ll|l|L)?([diufeEgG])')
+
+class TypeChecker:
+    """Resolves the declared C type of every variable and expression.
+
+    Each expression node gets a ``ctype`` attribute ('int' or 'float') that
+    the code generator uses to pick integer division, typed initial values
+    and float literals. Undeclared variables, redeclarations, printf/scanf
+    argument count mismatches, scanf conversions that do not match the
+    target's type and scanf formats the whitespace-separated input reader
+    cannot honour (field widths, literal text) are reported as errors.
+
+    Each compound statement is a scope, as in C. The generated Python has a
+    single namespace per function, so a declaration that shadows a visible
+    variable is renamed, along with the uses that refer to it.
+    """
+    def __init__(self):
+        self.scopes = [{}]  # Innermost last: name -> (ctype, Python name)
+        self.symbols = {}  # Every Python name -> ctype
+
+    def resolve(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return None
+
+    def error(self, message):
+        raise Exception(f'Type error: {message}')
+
+    def visit(self, node):
+        method_name = f'visit_{type(node).__name__}'
+        visitor = getattr(self, method_name, self.generic_visit)
+        return visitor(node)
+
+    def generic_visit(self, node):
+        raise Exception(f'No visit_{type(node).__name__} method')
+
+    def lookup(self, var_node):
+        symbol = self.resolve(var_node.value)
+        if symbol is None:
+            self.error(f"'{var_node.value}' undeclared")
+        ctype, var_node.value = symbol
+        return ctype
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        # Arithmetic on mixed operands is done in float, as in C
+        node.operand_type = 'float' if 'float' in (left, right) else 'int'
+        if node.op.type in ('PLUS', 'MINUS', 'MULTIPLY', 'DIVIDE'):
+            node.ctype = node.operand_type
+        else:
+            node.ctype = 'int'  # Comparisons yield 0 or 1
+        return node.ctype
+
+    def visit_UnaryOp(self, node):
+        node.ctype = self.visit(node.expr)
+        return node.ctype
+
+    def visit_Num(self, node):
+        node.ctype = 'float' if node.token.type == 'FLOAT_CONST' else 'int'
+        return node.ctype
+
+    def visit_Var(self, node):
+        node.ctype = self.lookup(node)
+        return node.ctype
+
+    def visit_Assign(self, node):
+        node.ctype = self.visit(node.left)
+        self.visit(node.right)
+        return node.ctype
+
+    def visit_Compound(self, node):
+        self.scopes.append({})
+        for child in node.children:
+            self.visit(child)
+        self.scopes.pop()
+
+    def visit_If(self, node):
+        self.visit(node.condition)
+        self.visit(node.true_body)
+        if node.false_body:
+            self.visit(node.false_body)
+
+    def visit_While(self, node):
+        self.visit(node.condition)
+        self.visit(node.body)
+
+    def visit_VarDecl(self, node):
+        name = node.var_node.value
+        ctype = node.type_node.value
+        if ctype not in ('int', 'float'):
+            self.error(f"variable '{name}' declared {ctype}")
+        if name in self.scopes[-1]:
+            self.error(f"redeclaration of '{name}'")
+        py_name = name
+        if any(py_name == visible for scope in self.scopes for _, visible in scope.values()):
+            count = 1
+            while f'{name}_{count}' in self.symbols:
+                count += 1
+            py_name = f'{name}_{count}'
+        self.scopes[-1][name] = (ctype, py_name)
+        self.symbols[py_name] = ctype
+        node.var_node.value = py_name
+        node.ctype = node.var_node.ctype = ctype
+
+    def visit_Printf(self, node):
+        for arg in node.args:
+            self.visit(arg)
+        conversions = node.format_str.replace('%%', '').count('%')
+        if conversions != len(node.args):
+            self.error(f'printf format expects {conversions} argument(s), got {len(node.args)}')
+
+    def visit_Scanf(self, node):
+        conversions = SCANF_SPEC.findall(node.format_str)
+        if len(conversions) != len(node.targets) or len(conversions) != node.format_str.count('%'):
+            self.error(f'scanf format expects {node.format_str.count("%")} argument(s), got {len(node.targets)}')
+        literal = SCANF_SPEC.sub('', node.format_str).strip()
+        if literal:
+            self.error(f"scanf inputs are separated by whitespace, '{literal}' cannot be matched")
+        for (width, conversion), target in zip(conversions, node.targets):
+            if width:
+                self.error(f'scanf field widths are not supported: %{width}{conversion}')
+            expected = 'int' if conversion in 'diu' else 'float'
+            if self.visit(target) != expected:
+                self.error(f"scanf %{conversion} expects {expected}, but '{target.value}' is {target.ctype}")
+
+    def visit_FunctionDecl(self, node):
+        self.visit(node.body)
+
+    def check(self, node):
+        """Annotate the AST in place and return the symbol table"""
+        self.visit(node)
+        return self.symbols
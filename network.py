@@ -0,0 +1,297 @@
+import asyncio
+import threading
+from collections import deque
+from session import (EV_POINT, EV_PEN_UP, EV_CLEAR, EV_COLOR, EV_FILL, EV_SHAPE,
+                     EV_STAMP)
+
+# Shared canvas: participants stream their drawing events to a relay, which
+# forwards them to everyone else. Each frame's events go out as one message,
+# a varint byte length and then the records. A record is the event byte, as
+# in session files, and its arguments as zigzag varints: points and stamps
+# carry the change from the hand's previous point, so a fingertip sample
+# usually takes three bytes; tool events carry their value. The relay puts
+# the sender's id, a varint, in front of the records it forwards.
+NETWORK_EVENTS = {EV_POINT, EV_PEN_UP, EV_CLEAR, EV_COLOR, EV_FILL, EV_SHAPE, EV_STAMP}
+EV_BASE = 15  # On the wire only: moves a hand's delta baseline, drawing nothing
+TOOL_EVENTS = (EV_COLOR, EV_FILL, EV_SHAPE)
+
+
+def put_varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def get_varint(data, pos):
+    """Return (value, position after it)"""
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def zigzag(n):
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def unzigzag(n):
+    return n >> 1 if not n & 1 else -(n >> 1) - 1
+
+
+class StrokeEncoder:
+    """Batches one participant's drawing events into delta-encoded messages.
+
+    Used as a recorder; ``flush`` returns the frame's message, or None when
+    nothing was drawn.
+    """
+
+    def __init__(self):
+        self.batch = bytearray()
+        self.last = {}  # Previous point of each hand
+
+    def record(self, event, a=0, b=0, hand=0):
+        if event not in NETWORK_EVENTS and event != EV_BASE:
+            return
+        self.batch.append(event | hand << 4)
+        if event in (EV_POINT, EV_STAMP, EV_BASE):
+            x, y = self.last.get(hand, (0, 0))
+            self.last[hand] = (a, b)
+            a, b = a - x, b - y
+        elif event in (EV_PEN_UP, EV_CLEAR):
+            return
+        put_varint(self.batch, zigzag(int(a)))
+        if event in (EV_POINT, EV_STAMP, EV_BASE):
+            put_varint(self.batch, zigzag(int(b)))
+
+    def flush(self):
+        if not self.batch:
+            return None
+        message = bytearray()
+        put_varint(message, len(self.batch))
+        message += self.batch
+        self.batch.clear()
+        return bytes(message)
+
+
+class StrokeDecoder:
+    """Turns the records of one participant's messages back into (event, a, b)."""
+
+    def __init__(self):
+        self.last = {}
+
+    def decode(self, data, pos=0):
+        records = []
+        while pos < len(data):
+            code = data[pos]
+            hand, event = code >> 4, code & 0xF
+            pos += 1
+            a = b = 0
+            if event not in (EV_PEN_UP, EV_CLEAR):
+                a, pos = get_varint(data, pos)
+                a = unzigzag(a)
+            if event in (EV_POINT, EV_STAMP, EV_BASE):
+                b, pos = get_varint(data, pos)
+                x, y = self.last.get(hand, (0, 0))
+                a, b = x + a, y + unzigzag(b)
+                self.last[hand] = (a, b)
+                if event == EV_BASE:
+                    continue
+            records.append((code, a, b))
+        return records
+
+
+async def read_message(reader):
+    """Read one length-prefixed message; None when the stream ends"""
+    length = shift = 0
+    try:
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        return await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+def relay_message(peer, payload):
+    """Frame a participant's records as the relay forwards them"""
+    body = bytearray()
+    put_varint(body, peer)
+    body += payload
+    message = bytearray()
+    put_varint(message, len(body))
+    return bytes(message + body)
+
+
+class RelayServer:
+    """Forwards each participant's messages to all the others over TCP.
+
+    The messages since the last clear are kept, so a participant that joins
+    late replays the drawing on the canvas. Whenever someone clears, the
+    log is cut down to that message, behind one prelude per participant
+    that restores its tools and delta baselines as they were. The log
+    therefore only holds what was drawn since the last clear, at about
+    three bytes per fingertip sample. Participants too slow to keep up are
+    disconnected rather than buffered for.
+    """
+
+    def __init__(self, max_buffer=1 << 22):
+        self.writers = {}
+        self.log = []
+        self.decoders = {}  # Each participant's stream, decoded to track its state
+        self.tools = {}  # (participant, hand) -> [color, fill, shape]
+        self.next_peer = 1
+        self.max_buffer = max_buffer
+
+    def state(self, peer):
+        """A participant's tools, {hand: [color, fill, shape]}, and delta baselines"""
+        tools = {hand: list(values) for (owner, hand), values in self.tools.items() if owner == peer}
+        return tools, dict(self.decoders[peer].last)
+
+    def prelude(self, peer, tools, last):
+        """A message that brings a fresh decoder and pens to a participant's
+        ``tools`` and delta baselines ``last``, without drawing anything"""
+        encoder = StrokeEncoder()
+        for hand, values in tools.items():
+            for event, value in zip(TOOL_EVENTS, values):
+                if value:
+                    encoder.record(event, value, hand=hand)
+        for hand, (x, y) in last.items():
+            encoder.record(EV_BASE, x, y, hand)
+        return relay_message(peer, encoder.batch) if encoder.batch else None
+
+    def track(self, peer, payload):
+        """Follow a participant's tool changes; returns whether it cleared"""
+        cleared = False
+        for code, a, b in self.decoders[peer].decode(payload):
+            hand, event = code >> 4, code & 0xF
+            if event in TOOL_EVENTS:
+                self.tools.setdefault((peer, hand), [0, 0, 0])[TOOL_EVENTS.index(event)] = a
+            elif event == EV_CLEAR:
+                cleared = True
+        return cleared
+
+    def compact(self, peer, before):
+        """Cut the log down for a clear from ``peer``, whose state was
+        ``before`` the message holding it"""
+        for other in list(self.decoders):
+            if other not in self.writers:
+                # Gone, and nothing of theirs is left on the canvas
+                del self.decoders[other]
+                self.tools = {key: value for key, value in self.tools.items() if key[0] != other}
+        states = {other: before if other == peer else self.state(other) for other in self.decoders}
+        preludes = (self.prelude(other, *state) for other, state in states.items())
+        self.log = [prelude for prelude in preludes if prelude is not None]
+
+    async def handle(self, reader, writer):
+        peer = self.next_peer
+        self.next_peer += 1
+        for message in self.log:
+            writer.write(message)
+        self.writers[peer] = writer
+        self.decoders[peer] = StrokeDecoder()
+        try:
+            while True:
+                payload = await read_message(reader)
+                if payload is None:
+                    break
+                message = relay_message(peer, payload)
+                before = self.state(peer)
+                if self.track(peer, payload):
+                    self.compact(peer, before)
+                self.log.append(message)
+                for other, other_writer in list(self.writers.items()):
+                    if other == peer:
+                        continue
+                    if other_writer.transport.get_write_buffer_size() > self.max_buffer:
+                        other_writer.close()
+                        del self.writers[other]
+                    else:
+                        other_writer.write(message)
+        finally:
+            self.writers.pop(peer, None)
+            writer.close()
+
+    async def serve(self, host, port, started=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        if started is not None:
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+
+class CanvasLink:
+    """A participant's connection to the relay, on an asyncio loop in a
+    background thread.
+
+    It records the local events like a session recorder; ``exchange``, once
+    per frame, sends them as one message and returns the (participant,
+    records) received since the last call.
+    """
+
+    def __init__(self, host, port, timeout=5.0):
+        self.encoder = StrokeEncoder()
+        self.decoders = {}
+        self.inbox = deque()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        connect = asyncio.open_connection(host, port)
+        self.reader, self.writer = asyncio.run_coroutine_threadsafe(connect, self.loop).result(timeout)
+        self.receiving = asyncio.run_coroutine_threadsafe(self._receive(), self.loop)
+        self.sent = 0
+
+    async def _receive(self):
+        while True:
+            message = await read_message(self.reader)
+            if message is None:
+                break
+            self.inbox.append(message)
+
+    def record(self, event, a=0, b=0, hand=0):
+        self.encoder.record(event, a, b, hand)
+
+    def exchange(self):
+        message = self.encoder.flush()
+        if message is not None:
+            self.sent += len(message)
+            self.loop.call_soon_threadsafe(self.writer.write, message)
+        received = []
+        while self.inbox:
+            message = self.inbox.popleft()
+            peer, pos = get_varint(message, 0)
+            decoder = self.decoders.setdefault(peer, StrokeDecoder())
+            received.append((peer, decoder.decode(message, pos)))
+        return received
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+        try:
+            self.receiving.result(timeout=1)  # Ends once the connection is closed
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=1)
+
+
+def start_relay(host, port):
+    """Run a RelayServer on a daemon thread; returns once it is listening"""
+    started = threading.Event()
+    relay = RelayServer()
+    thread = threading.Thread(target=asyncio.run, args=(relay.serve(host, port, started),), daemon=True)
+    thread.start()
+    if not started.wait(5):
+        raise Exception(f"Relay server did not start on {host}:{port}")
+    return relay
+
+
+def parse_address(address, default_host='127.0.0.1'):
+    host, _, port = address.rpartition(':')
+    return host or default_host, int(port)
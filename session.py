@@ -0,0 +1,44 @@
+import struct
+import time
+
+# Session files: a header, then fixed-size records of (event, milliseconds
+# since the session started, two int16 arguments). Points and stamps carry
+# canvas coordinates; tool events carry the new tool value. Commit closes an
+# undo step. Reset marks a clear of a shared canvas, by anyone, after which
+# the undo history starts again. The high four bits of the event byte hold
+# the index of the hand that drew it.
+SESSION_MAGIC = b'ACS1'
+SESSION_HEADER = struct.Struct('<4sHH')  # magic, canvas width, canvas height
+SESSION_RECORD = struct.Struct('<BIhh')
+(EV_POINT, EV_PEN_UP, EV_CLEAR, EV_COLOR, EV_FILL, EV_SHAPE, EV_STAMP,
+ EV_COMMIT, EV_UNDO, EV_REDO, EV_RESET) = range(11)
+
+
+class SessionRecorder:
+    """Appends drawing events to a session file through a buffered stream."""
+
+    def __init__(self, path, width, height):
+        self.file = open(path, 'wb', buffering=1 << 16)
+        self.file.write(SESSION_HEADER.pack(SESSION_MAGIC, width, height))
+        self.start = time.perf_counter()
+        self.pack = SESSION_RECORD.pack
+
+    def record(self, event, a=0, b=0, hand=0):
+        t = int((time.perf_counter() - self.start) * 1000)
+        self.file.write(self.pack(event | hand << 4, t, a, b))
+
+    def close(self):
+        self.file.close()
+
+
+def read_session(path):
+    """Return (width, height, records) from a session file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, width, height = SESSION_HEADER.unpack_from(data)
+    if magic != SESSION_MAGIC:
+        raise ValueError(f"{path} is not an aircanvas session")
+    body = memoryview(data)[SESSION_HEADER.size:]
+    # A session cut short by a crash may end in a partial record
+    body = body[:len(body) - len(body) % SESSION_RECORD.size]
+    return width, height, list(SESSION_RECORD.iter_unpack(body))
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+def svg_path(stroke, closed=False):
+    """SVG path data through a stroke's samples: straight lines, or the
+    Catmull-Rom curve as cubic Beziers when it has enough samples"""
+    x, y = stroke[0].tolist()
+    data = [f"M{x},{y}"]
+    if len(stroke) < 3:
+        data.extend(f"L{x},{y}" for x, y in stroke[1:].tolist())
+    else:
+        padded = np.concatenate((stroke[:1], stroke, stroke[-1:])).astype(np.float64)
+        p0, p1, p2, p3 = padded[:-3], padded[1:-2], padded[2:-1], padded[3:]
+        c1 = p1 + (p2 - p0) / 6
+        c2 = p2 - (p3 - p1) / 6
+        data.extend(f"C{a:.1f},{b:.1f} {c:.1f},{d:.1f} {e:g},{f:g}"
+                    for a, b, c, d, e, f in np.hstack((c1, c2, p2)).tolist())
+    if closed:
+        data.append("Z")
+    return " ".join(data)
+
+
+def export_svg(drawing, path, width, height, fit=False):
+    """Write the strokes, fills and shape stamps of every pen of a drawing as
+    an SVG file, stacked in the order they were painted. The view is the
+    width x height canvas, or with ``fit`` the bounds of the drawing, as on
+    the infinite canvas."""
+    def rgb(color):
+        b, g, r = color
+        return f"#{r:02x}{g:02x}{b:02x}"
+
+    items = []  # (paint order, element, (x0, y0, x1, y1))
+    for pen in drawing.pens:
+        strokes = pen.strokes
+        for i in range(len(strokes)):
+            stroke = strokes.stroke(i)
+            if len(stroke) == 0:
+                continue
+            color, stroke_width = rgb(strokes.color(i)), int(strokes.widths[i])
+            closed = i in pen.filled
+            # A filled stroke is painted again, outline and all, when it is filled
+            order = pen.filled[i] if closed else int(strokes.order[i])
+            (x0, y0), (x1, y1) = stroke.min(axis=0).tolist(), stroke.max(axis=0).tolist()
+            bounds = (x0 - stroke_width, y0 - stroke_width, x1 + stroke_width, y1 + stroke_width)
+            if drawing.spline:
+                fill = color if closed else "none"
+                element = (f'<path d="{svg_path(stroke, closed)}" fill="{fill}" stroke="{color}" '
+                           f'stroke-width="{stroke_width}" stroke-linecap="round" stroke-linejoin="round"/>')
+            else:
+                points = " ".join(f"{x},{y}" for x, y in stroke.tolist())
+                if closed:
+                    element = (f'<polygon points="{points}" fill="{color}" stroke="{color}" '
+                               f'stroke-width="{stroke_width}" stroke-linejoin="round"/>')
+                else:
+                    element = (f'<polyline points="{points}" fill="none" stroke="{color}" '
+                               f'stroke-width="{stroke_width}" stroke-linecap="round" '
+                               f'stroke-linejoin="round"/>')
+            items.append((order, element, bounds))
+        for shape, (x, y), color, order in pen.stamps:
+            if shape == 1:
+                element = f'<circle cx="{x}" cy="{y}" r="20" fill="{rgb(color)}"/>'
+            elif shape == 2:
+                element = f'<rect x="{x - 20}" y="{y - 20}" width="40" height="40" fill="{rgb(color)}"/>'
+            elif shape == 3:
+                element = (f'<polygon points="{x},{y - 20} {x - 20},{y + 20} {x + 20},{y + 20}" '
+                           f'fill="{rgb(color)}"/>')
+            else:
+                continue
+            items.append((order, element, (x - 20, y - 20, x + 20, y + 20)))
+    items.sort(key=lambda item: item[0])
+
+    x0, y0 = 0, 0
+    if fit and items:
+        bounds = np.array([item[2] for item in items])
+        (x0, y0), (x1, y1) = bounds[:, :2].min(axis=0).tolist(), bounds[:, 2:].max(axis=0).tolist()
+        width, height = x1 - x0, y1 - y0
+    lines = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="{x0} {y0} {width} {height}">',
+             f'<rect x="{x0}" y="{y0}" width="{width}" height="{height}" fill="#ffffff"/>']
+    lines.extend(element for order, element, bounds in items)
+    lines.append('</svg>')
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")